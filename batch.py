@@ -0,0 +1,264 @@
+"""
+Seat a batch of trip manifests without the GUI
+Manifests with several departures (e.g. a day's booking export) are split into one seating chart per departure
+
+    python batch.py manifests/ --boat 1 --output results
+    python batch.py "manifests/2020-6-6_*.csv" --boat 3
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import cv2
+
+import particle_simulation as ps
+import ride
+import pdf
+import settings
+import layout
+import trial_runner
+import results_cache
+
+
+def find_manifests(paths):
+    """
+    Expand the command line paths into manifest files
+    :param paths: a list of csv files, directories and/or glob patterns
+    :return: a sorted list of csv file names
+    """
+    manifests = set()
+
+    for path in paths:
+        if os.path.isdir(path):
+            manifests.update(glob.glob(os.path.join(path, "*.csv")))
+        else:
+            manifests.update(glob.glob(path))
+
+    return sorted(manifests)
+
+
+def get_output_name(name, departure):
+    """
+    Get the output file name of one departure of a multi-departure manifest
+    :param name: the manifest's name
+    :param departure: the departure's Event Date
+    :return: a file name (without extension)
+    """
+    return "%s_%s" % (name, re.sub(r'[^0-9A-Za-z]+', '-', departure).strip('-'))
+
+
+def get_seat_map(trip, energy, boat):
+    """
+    Get a JSON friendly description of a seated trip
+    :param trip: the seated trip
+    :param energy: the system energy of the seating chart
+    :param boat: the boat's settings
+    :return: a dictionary
+    """
+    groups = list()
+    for group in trip.groups:
+        seats = [passenger.position for passenger in group.passengers]
+        seats.sort()
+
+        groups.append({'confirmation_number': group.confirmation_number,
+                       'name': "%s %s" % (group.first_name, group.last_name),
+                       'adults': group.adults,
+                       'children': group.children,
+                       'seats': seats})
+
+    groups.sort(key=lambda group: group['seats'])
+
+    return {'departure': trip.ride_date,
+            'boat': boat.name,
+            'energy': energy,
+            'groups': groups}
+
+
+def write_results(output_dir, name, trip, sim, energy, boat):
+    """
+    Write the image, PDF and JSON seat map of a seated trip
+    :return: None
+    """
+    image_file = os.path.join(output_dir, name + ".png")
+    cv2.imwrite(image_file, sim.get_image())
+
+    pdf.generate_pdf(os.path.join(output_dir, name + ".pdf"), trip, image_file)
+
+    with open(os.path.join(output_dir, name + ".json"), 'w') as file:
+        json.dump(get_seat_map(trip, energy, boat), file, indent=2)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Seat a batch of trip manifests")
+    parser.add_argument('manifests', nargs='+', help="manifest csv files, directories or glob patterns")
+    parser.add_argument('--boat', type=int, default=1, help="the boat id from settings.json (default: 1)")
+    parser.add_argument('--output', default="results", help="the output directory (default: results)")
+    parser.add_argument('--trials', type=int, default=None, help="trials per manifest (default: settings.json)")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: settings.json)")
+    parser.add_argument('--time-budget', type=float, default=None,
+                        help="seconds to spend per manifest, 0 for no limit (default: settings.json)")
+    parser.add_argument('--optimizer', choices=sorted(ps.OPTIMIZERS), default=None,
+                        help="optimizer engine (default: settings.json)")
+    parser.add_argument('--no-cache', action='store_true', help="ignore and don't update the results cache")
+    args = parser.parse_args(args)
+
+    if args.trials is not None and args.trials < 1:
+        parser.error("--trials must be at least 1")
+    if args.workers is not None and args.workers < 0:
+        parser.error("--workers can't be negative (0 uses every core)")
+
+    settings_file = settings.Settings()
+
+    # A copy with the command line overrides, so the results cache is keyed by the settings actually used
+    sim_settings = settings.SimSettings(settings_file.get_sim_settings().get_data())
+    if args.trials is not None:
+        sim_settings.trials = args.trials
+    if args.workers is not None:
+        sim_settings.workers = args.workers
+    if args.optimizer is not None:
+        sim_settings.optimizer = args.optimizer
+    if args.time_budget is not None:
+        sim_settings.time_budget = args.time_budget
+
+    boat = None
+    for vessel in settings_file.get_available_boats():
+        if vessel.id == args.boat:
+            boat = vessel
+            break
+
+    if boat is None:
+        parser.error("Unknown boat id: %d" % args.boat)
+
+    layout_graph = layout.get_boat_graph(boat)
+    seat_count = len(layout_graph.get_nodes())
+    cache = results_cache.ResultsCache()
+
+    manifests = find_manifests(args.manifests)
+    if len(manifests) == 0:
+        parser.error("No manifest files found")
+
+    os.makedirs(args.output, exist_ok=True)
+
+    # Split every manifest into its departures
+    departures = list()
+    for manifest in manifests:
+        errors = list()
+        trips = ride.load_trips(manifest, errors)
+
+        for error in errors:
+            print("%s line %d: %s" % (manifest, error.line, error.message), file=sys.stderr)
+
+        name = os.path.splitext(os.path.basename(manifest))[0]
+        for departure, trip in trips.items():
+            if len(trips) > 1:
+                departures.append(("%s %s" % (manifest, departure), get_output_name(name, departure), trip))
+            else:
+                departures.append((manifest, name, trip))
+
+    # Queue every departure's trials on one pool so all of them are seated in parallel
+    jobs = list()
+    with ProcessPoolExecutor(max_workers=trial_runner.get_worker_count(sim_settings.workers)) as executor:
+
+        for manifest, name, trip in departures:
+            passengers = trip.get_passengers()
+
+            if len(passengers) > seat_count:
+                print("Skipping %s: there are more passengers than seats" % manifest, file=sys.stderr)
+                continue
+
+            # Departures seated before with the same boat and settings are not run again
+            cached = None if args.no_cache else cache.lookup(passengers, layout_graph, sim_settings)
+            if cached is not None:
+                jobs.append({'manifest': manifest,
+                             'name': name,
+                             'trip': trip,
+                             'passengers': passengers,
+                             'futures': list(),
+                             'scheduler': None,
+                             'best': cached})
+                continue
+
+            runner = trial_runner.TrialRunner(boat.layout_file, boat.image_file, passengers,
+                                              sim_settings.repulsive_force, sim_settings.attractive_force,
+                                              sim_settings.orphan_penalty, optimizer=sim_settings.optimizer,
+                                              max_iterations=sim_settings.max_iterations,
+                                              workers=sim_settings.workers,
+                                              exact_max_seats=sim_settings.exact_max_seats,
+                                              exact_max_nodes=sim_settings.exact_max_nodes,
+                                              trial_time_limit=sim_settings.trial_time_limit,
+                                              initializer=sim_settings.initializer,
+                                              collect_stats=sim_settings.collect_stats,
+                                              seed=sim_settings.seed,
+                                              optimizer_options=sim_settings.get_optimizer_options())
+            jobs.append({'manifest': manifest,
+                         'name': name,
+                         'trip': trip,
+                         'passengers': passengers,
+                         'trials': sim_settings.trials,
+                         'futures': runner.submit(executor, sim_settings.trials),
+                         'scheduler': None,
+                         'runner': runner,
+                         'stats': runner.stats,
+                         'seed': runner.seed,
+                         'best': None})
+
+        pending = dict()
+        for job in jobs:
+            for future in job['futures']:
+                pending[future] = job
+
+        while len(pending) > 0:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                job = pending.pop(future)
+                if future.cancelled():
+                    continue
+
+                # A manifest's time budget starts with its first finished batch
+                if job['scheduler'] is None:
+                    job['scheduler'] = trial_runner.TrialScheduler(job['trials'],
+                                                                   patience=sim_settings.plateau_trials,
+                                                                   time_budget=sim_settings.time_budget)
+
+                for result in job['runner'].collect(future):
+                    job['scheduler'].add_result(result[0])
+                    if job['best'] is None or result[0] < job['best'][0]:
+                        job['best'] = result
+
+                if job['runner'].optimal:
+                    job['scheduler'].set_optimal()
+
+                # Drop the manifest's queued trials once it has converged (or been solved)
+                if job['scheduler'].should_stop():
+                    for queued in job['futures']:
+                        if queued.cancel():
+                            pending.pop(queued, None)
+
+    for job in jobs:
+        energy, seats = job['best']
+
+        boat_graph = layout.get_boat_graph(boat)
+        sim = ps.Simulation(boat_graph, job['passengers'], sim_settings.repulsive_force,
+                            sim_settings.attractive_force, sim_settings.orphan_penalty)
+        sim.set_seats(seats)
+
+        write_results(args.output, job['name'], job['trip'], sim, energy, boat)
+
+        if job['scheduler'] is None:
+            print("Seated %s (energy %.3f) from the results cache" % (job['manifest'], energy))
+        else:
+            if not args.no_cache:
+                cache.store(job['passengers'], boat_graph, sim_settings, energy, seats)
+            if job['stats'] is not None:
+                job['stats'].save(os.path.join(args.output, job['name'] + ".stats.json"))
+            print("Seated %s (energy %.3f) %s, seed %d" % (job['manifest'], energy, job['scheduler'].get_summary(),
+                                                            job['seed']))
+
+
+if __name__ == '__main__':
+    main()
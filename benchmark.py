@@ -0,0 +1,204 @@
+"""
+Measure seating throughput and chart quality on synthetic manifests
+
+    python benchmark.py --trials 20 --output benchmark.json
+    python benchmark.py --boats 1 --optimizers annealing --compare benchmark.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import time
+import tracemalloc
+
+import numpy as np
+
+import particle_simulation as ps
+import ride
+import settings
+import layout
+import trial_runner
+
+
+# Share of the boat's seats that are booked
+FILL_RATIOS = (0.5, 0.75, 0.95)
+
+# Group mix -> (adults, children) choices for a booking
+GROUP_MIXES = {'adults': [(1, 0), (2, 0), (3, 0), (4, 0)],
+               'families': [(1, 1), (1, 2), (2, 1), (2, 2), (2, 3), (1, 3)],
+               'mixed': [(1, 0), (2, 0), (4, 0), (1, 1), (2, 1), (2, 2), (2, 3), (6, 0)]}
+
+
+def make_trip(seats, fill, mix, rng):
+    """
+    Build a synthetic trip
+    :param seats: the number of seats on the boat
+    :param fill: the share of the seats to book
+    :param mix: the group mix (see GROUP_MIXES)
+    :param rng: a random.Random
+    :return: a Trip
+    """
+    remaining = int(round(seats * fill))
+    records = list()
+
+    while remaining > 0:
+        adults, children = rng.choice(GROUP_MIXES[mix])
+
+        # Trim the last booking to fit the boat
+        while adults + children > remaining:
+            if children > 0:
+                children -= 1
+            else:
+                adults -= 1
+
+        records.append(ride.GroupRecord(line=len(records) + 1, ride_date="benchmark", first_name="Guest",
+                                        last_name=str(len(records) + 1), group_name="",
+                                        confirmation_number="SYN-%04d" % len(records), adults=adults,
+                                        children=children, comps=0, total=adults + children))
+        remaining -= adults + children
+
+    return ride.Trip(records=records)
+
+
+def run_case(boat_graph, passengers, sim_settings, optimizer, initializer, trials, seed=0):
+    """
+    Run the trials of one benchmark case in this process
+    Trial i is seeded with get_trial_seed(seed, i), as it would be on the worker pool
+    :return: a dictionary of measurements
+    """
+    sim = ps.Simulation(boat_graph, passengers, sim_settings.repulsive_force, sim_settings.attractive_force,
+                        sim_settings.orphan_penalty)
+
+    energies = list()
+    iterations = list()
+    sweeps = list()
+
+    options = sim_settings.get_optimizer_options(optimizer)
+
+    start = time.perf_counter()
+    for trial in range(trials):
+        energy = trial_runner.run_trial(sim, seed, trial, optimizer, sim_settings.max_iterations,
+                                        initializer=initializer, optimizer_options=options)
+        energies.append(float(energy))
+        iterations.append(sim.iterations)
+        sweeps.append(sim.annealing_sweeps)
+    seconds = time.perf_counter() - start
+
+    # Measured on one extra trial, tracing slows everything down
+    tracemalloc.start()
+    trial_runner.run_trial(sim, seed, trials, optimizer, sim_settings.max_iterations, initializer=initializer,
+                           optimizer_options=options)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    measurements = {'trials': trials,
+                    'seconds': seconds,
+                    'trials_per_second': trials / seconds,
+                    'iterations_mean': statistics.mean(iterations),
+                    'energy_best': min(energies),
+                    'energy_mean': statistics.mean(energies),
+                    'energy_median': statistics.median(energies),
+                    'peak_memory_kb': peak_memory / 1024.0}
+
+    # iterations_mean only counts the run_sim polish of an annealing trial, its own work is counted in sweeps
+    if optimizer == 'annealing':
+        measurements['annealing_sweeps_mean'] = statistics.mean(sweeps)
+    return measurements
+
+
+def get_case_key(case):
+    return case['boat'], case['fill'], case['mix'], case['optimizer'], case['initializer']
+
+
+def compare(report, baseline):
+    """
+    Print the change of every case against an earlier report
+    :return: None
+    """
+    baseline_cases = {get_case_key(case): case for case in baseline['cases']}
+
+    print("%-12s %5s %-9s %-10s %-8s %10s %12s" % ("boat", "fill", "mix", "optimizer", "init",
+                                                  "speed", "best energy"))
+    for case in report['cases']:
+        old = baseline_cases.get(get_case_key(case))
+        if old is None:
+            continue
+
+        print("%-12s %5.2f %-9s %-10s %-8s %9.2fx %+12.3f" % (case['boat'], case['fill'], case['mix'],
+                                                             case['optimizer'], case['initializer'],
+                                                             case['trials_per_second'] / old['trials_per_second'],
+                                                             case['energy_best'] - old['energy_best']))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark the seating simulation on synthetic manifests")
+    parser.add_argument('--boats', type=int, nargs='+', default=None, help="boat ids (default: every boat)")
+    parser.add_argument('--optimizers', nargs='+', choices=sorted(ps.OPTIMIZERS), default=sorted(ps.OPTIMIZERS))
+    parser.add_argument('--initializers', nargs='+', choices=sorted(ps.INITIALIZERS),
+                        default=sorted(ps.INITIALIZERS))
+    parser.add_argument('--trials', type=int, default=20, help="trials per case (default: 20)")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the manifests and the trials (default: 0)")
+    parser.add_argument('--output', default="benchmark.json", help="the report file (default: benchmark.json)")
+    parser.add_argument('--compare', default=None, help="an earlier report to compare against")
+    args = parser.parse_args(args)
+
+    settings_file = settings.Settings()
+    sim_settings = settings_file.get_sim_settings()
+
+    boats = settings_file.get_available_boats()
+    if args.boats is not None:
+        boats = [boat for boat in boats if boat.id in args.boats]
+
+    cases = list()
+    for boat in boats:
+        boat_graph = layout.get_boat_graph(boat)
+        seats = len(boat_graph.get_nodes())
+
+        for fill in FILL_RATIOS:
+            for mix in sorted(GROUP_MIXES):
+                trip = make_trip(seats, fill, mix, random.Random("%d %s %s %s" % (args.seed, boat.id, fill, mix)))
+                passengers = trip.get_passengers()
+
+                for optimizer in args.optimizers:
+                    for initializer in args.initializers:
+                        case = {'boat': boat.name,
+                                'seats': seats,
+                                'fill': fill,
+                                'mix': mix,
+                                'passengers': len(passengers),
+                                'groups': len(trip.groups),
+                                'optimizer': optimizer,
+                                'initializer': initializer}
+                        case.update(run_case(boat_graph, passengers, sim_settings, optimizer, initializer,
+                                             args.trials, seed=args.seed))
+                        cases.append(case)
+
+                        work = "%5.1f iterations" % case['iterations_mean']
+                        if 'annealing_sweeps_mean' in case:
+                            work = "%5.1f sweeps + %.1f polish iterations" % (case['annealing_sweeps_mean'],
+                                                                              case['iterations_mean'])
+
+                        print("%-12s %5.2f %-9s %-10s %-8s %8.1f trials/s %s  best %.3f" %
+                              (boat.name, fill, mix, optimizer, initializer, case['trials_per_second'], work,
+                               case['energy_best']))
+
+    report = {'created': time.strftime("%Y-%m-%d %H:%M:%S"),
+              'python': platform.python_version(),
+              'numpy': np.__version__,
+              'cpu_count': os.cpu_count(),
+              'seed': args.seed,
+              'settings': sim_settings.get_data(),
+              'cases': cases}
+
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as file:
+            compare(report, json.load(file))
+
+
+if __name__ == '__main__':
+    main()
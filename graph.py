@@ -1,7 +1,45 @@
 import math
+import os
 import cv2
 import numpy as np
 
+
+# Decoded boat images keyed by (file name, modification time)
+_base_images = dict()
+
+# HSV node colors converted to BGR
+_bgr_colors = dict()
+
+
+def get_base_image(file_name):
+    """
+    Get the decoded boat image, reading the file only once (or again if it changed on disk)
+    :param file_name: the boat's image file
+    :return: the BGR image (do not modify it)
+    """
+    key = (file_name, os.path.getmtime(file_name))
+
+    if key not in _base_images:
+        img = cv2.imread(file_name)
+
+        # Round trip through HSV like a drawn image does so the boat looks the same
+        img = cv2.cvtColor(cv2.cvtColor(img, cv2.COLOR_BGR2HSV), cv2.COLOR_HSV2BGR)
+
+        # Drop stale versions of the file
+        for old_key in [old_key for old_key in _base_images if old_key[0] == file_name]:
+            del _base_images[old_key]
+
+        _base_images[key] = img
+    return _base_images[key]
+
+
+def _to_bgr(hsv_color):
+    if hsv_color not in _bgr_colors:
+        pixel = np.array([[hsv_color]], dtype=np.uint8)
+        _bgr_colors[hsv_color] = tuple(int(c) for c in cv2.cvtColor(pixel, cv2.COLOR_HSV2BGR)[0, 0])
+    return _bgr_colors[hsv_color]
+
+
 class Graph:
     def __init__(self, base_img):
         self._base_img = base_img
@@ -10,6 +48,16 @@ class Graph:
         self._colors = dict()
         self.front_seats = set()
 
+        # Seat-index matrices (built lazily, once per layout)
+        self._node_names = None
+        self._node_indices = None
+        self._distances = None
+        self._inverse_square_distances = None
+        self._directions = None
+
+        # Reused between renders (see get_graph_image)
+        self._image_buffer = None
+
     def add_node(self, new_node, position, fill=(0, 0, 255), stroke=(0, 0, 0), accent=False, front_seat=False):
         self._nodes.add(new_node)
         self._positions[new_node] = position
@@ -17,12 +65,18 @@ class Graph:
         if front_seat:
             self.front_seats.add(new_node)
 
+        # The layout changed, the seat matrices must be rebuilt
+        self._node_names = None
+
     def set_color(self, node, fill, stroke, accent=False):
         self._colors[node] = (fill, stroke, accent)
 
     def get_nodes(self):
         return self._nodes.copy()
 
+    def get_position(self, node):
+        return self._positions[node]
+
     def get_weight(self, node_a, node_b):
         p0 = self._positions[node_a]
         p1 = self._positions[node_b]
@@ -33,201 +87,125 @@ class Graph:
         p1 = self._positions[node_b]
         return p0[0] - p1[0], p0[1] - p1[1]
 
+    def _build_matrices(self):
+        """
+        Build the dense seat-index matrices for the current layout
+        Seats are indexed in sorted name order
+        :return: None
+        """
+        names = sorted(self._nodes)
+        positions = np.array([self._positions[name] for name in names], dtype=float)
+
+        directions = positions[:, np.newaxis, :] - positions[np.newaxis, :, :]
+        distances = np.sqrt(directions[:, :, 0] ** 2 + directions[:, :, 1] ** 2)
+
+        inverse_square = np.zeros_like(distances)
+        off_diagonal = ~np.eye(len(names), dtype=bool)
+        inverse_square[off_diagonal] = 1.0 / distances[off_diagonal] ** 2
+
+        self._node_indices = {name: i for i, name in enumerate(names)}
+        self._distances = distances
+        self._inverse_square_distances = inverse_square
+        self._directions = directions
+        self._node_names = names
+
+    def share_matrices(self, other):
+        """
+        Reuse the seat matrices of a graph with the same seats (e.g. a boat layout's template)
+        :param other: the other graph
+        :return: None
+        """
+        other.get_node_names()
+
+        self._node_names = other._node_names
+        self._node_indices = other._node_indices
+        self._distances = other._distances
+        self._inverse_square_distances = other._inverse_square_distances
+        self._directions = other._directions
+
+    def get_node_names(self):
+        """
+        Get the seat names ordered by seat index
+        :return: a list of node names
+        """
+        if self._node_names is None:
+            self._build_matrices()
+        return list(self._node_names)
+
+    def get_node_index(self, node):
+        if self._node_names is None:
+            self._build_matrices()
+        return self._node_indices[node]
+
+    def get_distance_matrix(self):
+        """
+        Get the distance between every pair of seats
+        :return: an (n, n) array indexed by seat index
+        """
+        if self._node_names is None:
+            self._build_matrices()
+        return self._distances
+
+    def get_inverse_square_matrix(self):
+        """
+        Get 1 / distance^2 between every pair of seats (zero on the diagonal)
+        :return: an (n, n) array indexed by seat index
+        """
+        if self._node_names is None:
+            self._build_matrices()
+        return self._inverse_square_distances
+
+    def get_direction_matrix(self):
+        """
+        Get the direction vector between every pair of seats
+        directions[a, b] is the same as get_direction_vector(a, b)
+        :return: an (n, n, 2) array indexed by seat index
+        """
+        if self._node_names is None:
+            self._build_matrices()
+        return self._directions
+
+    def get_front_seat_mask(self):
+        """
+        :return: a boolean array, True for seat indices that are front seats
+        """
+        names = self.get_node_names()
+        return np.array([name in self.front_seats for name in names], dtype=bool)
+
     def show_graph(self):
         cv2.imshow("Result", self.get_graph_image())
         cv2.waitKey(0)
 
     def get_graph_image(self):
-        img = cv2.imread(self._base_img)
-        img = cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)
+        """
+        Draw the seats on the boat image
+        The image is a buffer reused by every render, so the next call overwrites it (copy it to keep it)
+        :return: the BGR image
+        """
+        base = get_base_image(self._base_img)
 
-        img_hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        if self._image_buffer is None or self._image_buffer.shape != base.shape:
+            self._image_buffer = np.empty_like(base)
+        img = self._image_buffer
+        np.copyto(img, base)
+
+        # Node positions are given on the image rotated 90 degrees clockwise
+        height = base.shape[0]
 
         for node in self._nodes:
-            position = self._positions[node]
+            x, y = self._positions[node]
+            position = (y, height - 1 - x)
             fill = self._colors[node][0]
             stroke = self._colors[node][1]
             accent = self._colors[node][2]
 
             if fill is not None:
-                img_hsv = cv2.circle(img_hsv, position, 20, fill, -1)
+                cv2.circle(img, position, 20, _to_bgr(tuple(fill)), -1)
 
             if stroke is not None:
-                img_hsv = cv2.circle(img_hsv, position, 20, stroke, 3)
+                cv2.circle(img, position, 20, _to_bgr(tuple(stroke)), 3)
 
             if accent:
-                img_hsv = cv2.circle(img_hsv, position, 5, (0, 0, 0), -1)
+                cv2.circle(img, position, 5, (0, 0, 0), -1)
 
-        img = cv2.cvtColor(img_hsv, cv2.COLOR_HSV2BGR)
-        img = cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)
         return img
-
-def init_rouge_wave_graph(image_file):
-    graph = Graph(image_file)
-    row = 60
-    row_increment = 95
-
-    graph.add_node("H1", (row, 86))
-    graph.add_node("H2", (row, 146))
-    graph.add_node("H3", (row, 206))
-    graph.add_node("H4", (row, 352))
-    graph.add_node("H5", (row, 412))
-    graph.add_node("H6", (row, 472))
-
-    row += row_increment
-    graph.add_node("G1", (row, 86))
-    graph.add_node("G2", (row, 146))
-    graph.add_node("G3", (row, 206))
-    graph.add_node("G4", (row, 352))
-    graph.add_node("G5", (row, 412))
-    graph.add_node("G6", (row, 472))
-
-    row += row_increment
-    graph.add_node("F1", (row, 86))
-    graph.add_node("F2", (row, 146))
-    graph.add_node("F3", (row, 206))
-    graph.add_node("F4", (row, 352))
-    graph.add_node("F5", (row, 412))
-    graph.add_node("F6", (row, 472))
-
-    row += row_increment
-    graph.add_node("E1", (row, 86))
-    graph.add_node("E2", (row, 146))
-    graph.add_node("E3", (row, 206))
-    graph.add_node("E4", (row, 352))
-    graph.add_node("E5", (row, 412))
-    graph.add_node("E6", (row, 472))
-
-    row += row_increment
-    graph.add_node("D1", (row, 86))
-    graph.add_node("D2", (row, 146))
-    graph.add_node("D3", (row, 206))
-    graph.add_node("D4", (row, 352))
-    graph.add_node("D5", (row, 412))
-    graph.add_node("D6", (row, 472))
-
-    row += row_increment
-    graph.add_node("C1", (row, 86))
-    graph.add_node("C2", (row, 146))
-    graph.add_node("C3", (row, 206))
-    graph.add_node("C4", (row, 352))
-    graph.add_node("C5", (row, 412))
-    graph.add_node("C6", (row, 472))
-
-    row += row_increment
-    graph.add_node("B1", (row, 146), front_seat=True)
-    graph.add_node("B2", (row, 206), front_seat=True)
-    graph.add_node("B3", (row, 352), front_seat=True)
-    graph.add_node("B4", (row, 412), front_seat=True)
-
-    row += row_increment
-    graph.add_node("A1", (row, 146), front_seat=True)
-    graph.add_node("A2", (row, 206), front_seat=True)
-    graph.add_node("A3", (row, 352), front_seat=True)
-    graph.add_node("A4", (row, 412), front_seat=True)
-
-    return graph
-
-
-def init_gale_force_graph(image_file):
-    graph = Graph(image_file)
-    row = 60
-    row_increment = 95
-
-    graph.add_node("H1", (row, 86))
-    graph.add_node("H2", (row, 146))
-    graph.add_node("H3", (row, 206))
-    graph.add_node("H4", (row, 352))
-    graph.add_node("H5", (row, 412))
-    graph.add_node("H6", (row, 472))
-
-    row += row_increment
-    graph.add_node("G1", (row, 86))
-    graph.add_node("G2", (row, 146))
-    graph.add_node("G3", (row, 206))
-    graph.add_node("G4", (row, 352))
-    graph.add_node("G5", (row, 412))
-    graph.add_node("G6", (row, 472))
-
-    row += row_increment
-    graph.add_node("F1", (row, 86))
-    graph.add_node("F2", (row, 146))
-    graph.add_node("F3", (row, 206))
-    graph.add_node("F4", (row, 352))
-    graph.add_node("F5", (row, 412))
-    graph.add_node("F6", (row, 472))
-
-    row += row_increment
-    graph.add_node("E1", (row, 86))
-    graph.add_node("E2", (row, 146))
-    graph.add_node("E3", (row, 206))
-    graph.add_node("E4", (row, 352))
-    graph.add_node("E5", (row, 412))
-    graph.add_node("E6", (row, 472))
-
-    row += row_increment
-    graph.add_node("D1", (row, 86))
-    graph.add_node("D2", (row, 146))
-    graph.add_node("D3", (row, 206))
-    graph.add_node("D4", (row, 352))
-    graph.add_node("D5", (row, 412))
-    graph.add_node("D6", (row, 472))
-
-    row += row_increment
-    graph.add_node("C1", (row, 86))
-    graph.add_node("C2", (row, 146))
-    graph.add_node("C3", (row, 206))
-    graph.add_node("C4", (row, 352))
-    graph.add_node("C5", (row, 412))
-    graph.add_node("C6", (row, 472))
-
-    row += row_increment
-    graph.add_node("B1", (row, 146), front_seat=True)
-    graph.add_node("B2", (row, 206), front_seat=True)
-    graph.add_node("B3", (row, 352), front_seat=True)
-    graph.add_node("B4", (row, 412), front_seat=True)
-
-    row += row_increment
-    graph.add_node("A1", (row, 146), front_seat=True)
-    graph.add_node("A2", (row, 206), front_seat=True)
-    graph.add_node("A3", (row, 352), front_seat=True)
-    graph.add_node("A4", (row, 412), front_seat=True)
-
-    return graph
-
-
-def init_island_girl_graph(image_file):
-    graph = Graph(image_file)
-    row = 188
-    row_increment = 98
-
-    graph.add_node("E1", (row, 150))
-    graph.add_node("E2", (row, 210))
-    graph.add_node("E3", (row, 355))
-    graph.add_node("E4", (row, 415))
-
-    row += row_increment
-    graph.add_node("D1", (row, 150))
-    graph.add_node("D2", (row, 210))
-    graph.add_node("D3", (row, 355))
-    graph.add_node("D4", (row, 415))
-
-    row += row_increment
-    graph.add_node("C1", (row, 150))
-    graph.add_node("C2", (row, 210))
-    graph.add_node("C3", (row, 355))
-    graph.add_node("C4", (row, 415))
-
-    row += row_increment
-    graph.add_node("B1", (row, 150))
-    graph.add_node("B2", (row, 210))
-    graph.add_node("B3", (row, 355))
-    graph.add_node("B4", (row, 415))
-
-    row += row_increment
-    graph.add_node("A1", (row, 150), front_seat=True)
-    graph.add_node("A2", (row, 210), front_seat=True)
-    graph.add_node("A3", (row, 355), front_seat=True)
-    graph.add_node("A4", (row, 415), front_seat=True)
-
-    return graph
@@ -2,35 +2,37 @@ from tkinter import Tk
 from tkinter import Frame, Label, Menu, Button, Entry, Scrollbar, Listbox
 from tkinter import filedialog as fd
 from tkinter import N, E, S, W, END, LEFT, RIGHT, BOTH, BOTTOM, Y, HORIZONTAL
-from tkinter import messagebox, Toplevel, Message, StringVar, TclError
+from tkinter import messagebox, Toplevel, Message, StringVar
 from tkinter.ttk import Progressbar
 
 from PIL import Image, ImageTk
 import cv2
-import copy
-import threading
-import queue
+import multiprocessing
+import time
+import numpy as np
 
-import graph
 import particle_simulation as ps
 import ride
 import pdf
 import settings
-import bucket_model
+import layout
+import trial_runner
+import results_cache
 
 settings_file = settings.Settings()
 
 trip = None
-attractive_force = settings_file.get_sim_settings().attractive_force
-repulsive_force = settings_file.get_sim_settings().repulsive_force
-orphan_penalty = settings_file.get_sim_settings().orphan_penalty
 
 boat_img = None
-boat_init_graph_function = None
+boat_layout_file = None
 result_img_name = "result.png"
+result_stats_name = "result_stats.json"
 
+# Seconds to spend re-seating the changed groups of an updated manifest
+incremental_time_budget = 0.5
 
-NUM_THREADS = 3
+# Milliseconds between progress window updates while a simulation runs
+progress_interval = 100
 
 class Window(Frame):
     def __init__(self, master=None):
@@ -38,6 +40,9 @@ class Window(Frame):
         self.master = master
         self.pack(fill=BOTH, expand=1)
 
+        # The running simulation (see _run_simulation)
+        self._simulation = None
+
         # Config menu
         menu = Menu(self.master)
         self.master.config(menu=menu)
@@ -50,13 +55,14 @@ class Window(Frame):
 
         sim_menu = Menu(menu, tearoff=0)
         sim_menu.add_command(label="Load Trip", command=self._get_csv_file)
+        sim_menu.add_command(label="Update Trip", command=self._update_trip)
         sim_menu.add_command(label="Run Simulation", command=self._run_simulation)
         menu.add_cascade(label="Simulation", menu=sim_menu)
 
+        # One entry per boat in settings.json
         boat_menu = Menu(sim_menu, tearoff=0)
-        boat_menu.add_command(label="Rogue Wave", command=self._update_boat_rw)
-        boat_menu.add_command(label="Gale Force", command=self._update_boat_gf)
-        boat_menu.add_command(label="Island Girl", command=self._update_boat_ig)
+        for boat in settings_file.get_available_boats():
+            boat_menu.add_command(label=boat.name, command=lambda boat=boat: self._update_boat(boat))
 
         sim_menu.add_cascade(label="Boat", menu=boat_menu)
 
@@ -76,48 +82,16 @@ class Window(Frame):
         # config image
         self.img = Label(self)
         self.img.pack(side=RIGHT, padx=10, pady=10, expand=False)
-        self._update_boat_rw()
+        self._update_boat(settings_file.get_available_boats()[0])
 
 
-    @staticmethod
-    def _exit_program():
+    def _exit_program(self):
         if messagebox.askokcancel("Quit", "Do you want to quit?"):
+            if self._simulation is not None:
+                self._simulation['runner'].abort()
             root.destroy()
 
-    def _update_boat_rw(self):
-        global settings_file
-        boats = settings_file.get_available_boats()
-
-        boat = None
-        for vessel in boats:
-            if vessel.id == 1:
-                boat = vessel
-                break
-
-        set_boat(boat)
-        self._load_img(boat.image_file)
-
-    def _update_boat_gf(self):
-        global settings_file
-        boats = settings_file.get_available_boats()
-
-        boat = None
-        for vessel in boats:
-            if vessel.id == 2:
-                boat = vessel
-                break
-        set_boat(boat)
-        self._load_img(boat.image_file)
-
-    def _update_boat_ig(self):
-        global settings_file
-        boats = settings_file.get_available_boats()
-
-        boat = None
-        for vessel in boats:
-            if vessel.id == 3:
-                boat = vessel
-                break
+    def _update_boat(self, boat):
         set_boat(boat)
         self._load_img(boat.image_file)
 
@@ -176,14 +150,104 @@ class Window(Frame):
         global trip
 
         file_name = fd.askopenfilename(filetypes=(("csv", ".csv"),))
-        trip = ride.Trip(file_name)
+
+        # Booking exports can hold a whole day of departures
+        errors = list()
+        departures = ride.load_trips(file_name, errors)
+
+        trip = ride.Trip()
+        if len(departures) > 0:
+            trip = list(departures.values())[0]
+        trip.errors = errors
+
+        if len(departures) > 1:
+            messagebox.showwarning('Warning', "The manifest has %d departures, only %s was loaded."
+                                              " Use batch.py to seat every departure." %
+                                   (len(departures), trip.ride_date))
+
         self._update_results()
+        self._show_manifest_errors(trip)
+
+    @staticmethod
+    def _show_manifest_errors(manifest_trip):
+        if len(manifest_trip.errors) == 0:
+            return
+
+        lines = ["Line %d: %s" % (error.line, error.message) for error in manifest_trip.errors[:10]]
+        if len(manifest_trip.errors) > 10:
+            lines.append("... and %d more" % (len(manifest_trip.errors) - 10))
+        messagebox.showwarning('Warning', "Some manifest rows were skipped:\n" + "\n".join(lines))
+
+    def _update_trip(self):
+        global trip
+
+        if trip is None or None in [passenger.position for passenger in trip.get_passengers()]:
+            messagebox.showerror('Error', 'Run the simulation on the trip before loading an updated manifest')
+            return
+
+        file_name = fd.askopenfilename(filetypes=(("csv", ".csv"),))
+
+        # Only the departure that was seated is updated from a multi-departure export
+        errors = list()
+        departures = ride.load_trips(file_name, errors)
+        if trip.ride_date not in departures:
+            messagebox.showerror('Error', "The manifest has no %s departure" % trip.ride_date)
+            return
+
+        new_trip = departures[trip.ride_date]
+        new_trip.errors = errors
+        self._show_manifest_errors(new_trip)
+
+        # Groups that haven't changed keep their seats, only the others are seated again
+        kept = new_trip.keep_seats(trip)
+        unchanged, changed, added, removed = new_trip.diff(trip)
+        trip = new_trip
+
+        passengers = list(trip.get_passengers())
+        boat_graph = layout.get_layout(boat_layout_file).create_graph(boat_img)
+
+        if len(passengers) > len(boat_graph.get_nodes()):
+            messagebox.showerror('Error', 'There are more passengers than seats!')
+            self._update_results()
+            return
+
+        # Seats that aren't on the current boat (it was changed since the trip was seated) are seated again
+        seat_names = set(boat_graph.get_node_names())
+        seats = np.full(len(passengers), -1, dtype=int)
+        for i, passenger in enumerate(passengers):
+            if passenger.position in seat_names:
+                seats[i] = boat_graph.get_node_index(passenger.position)
+            else:
+                passenger.position = None
+        kept = [group for group in kept if None not in [passenger.position for passenger in group.passengers]]
+
+        sim_settings = settings_file.get_sim_settings()
+        sim = ps.Simulation(boat_graph, passengers, sim_settings.repulsive_force, sim_settings.attractive_force,
+                            sim_settings.orphan_penalty)
+        options = sim_settings.get_optimizer_options()
+        (energy, best_seats), scheduler = trial_runner.run_incremental(sim, seats, seats >= 0,
+                                                                       optimizer=sim_settings.optimizer,
+                                                                       max_iterations=sim_settings.max_iterations,
+                                                                       trials=sim_settings.trials,
+                                                                       patience=sim_settings.plateau_trials,
+                                                                       time_budget=incremental_time_budget,
+                                                                       optimizer_options=options)
+
+        # Not cached: the short pinned run isn't the result of a full simulation with these settings
+        self._show_result(sim, best_seats,
+                          "Kept %d groups in their seats, seated %d changed and %d added groups (%d removed)" %
+                          (len(kept), len(changed), len(added), len(removed)))
 
     def _destroy_sim_progress(self):
         result = messagebox.askyesno('Warning', 'Are you sure you want to halt the simulation?')
-        if result:
+        if result and self._simulation is not None:
+            # Queued trials are dropped, running trials finish in the background
+            self._simulation['runner'].abort()
+            self._simulation = None
             self._progress_window.destroy()
 
+            messagebox.showwarning('Warning', 'Simulation Aborted')
+
     def _run_simulation(self):
         global trip
 
@@ -191,154 +255,178 @@ class Window(Frame):
             messagebox.showerror('Error', 'No trip manifest csv file loaded')
             return
 
+        if self._simulation is not None:
+            messagebox.showerror('Error', 'A simulation is already running')
+            return
+
+        passengers = list(trip.get_passengers())
+        boat_graph = layout.get_layout(boat_layout_file).create_graph(boat_img)
+
+        if len(passengers) > len(boat_graph.get_nodes()):
+            messagebox.showerror('Error', 'There are more passengers than seats!')
+            return
+
+        sim_settings = settings_file.get_sim_settings()
+        sim = ps.Simulation(boat_graph, passengers, sim_settings.repulsive_force, sim_settings.attractive_force,
+                            sim_settings.orphan_penalty)
+
+        # The same trip has been seated before with these settings
+        cache = results_cache.ResultsCache()
+        cached = cache.lookup(passengers, boat_graph, sim_settings)
+        if cached is not None:
+            self._show_result(sim, cached[1], "Loaded the cached result (energy %.3f)" % cached[0])
+            return
+
+        runner = trial_runner.TrialRunner(boat_layout_file, boat_img, passengers,
+                                          sim_settings.repulsive_force, sim_settings.attractive_force,
+                                          sim_settings.orphan_penalty,
+                                          optimizer=sim_settings.optimizer,
+                                          max_iterations=sim_settings.max_iterations,
+                                          workers=sim_settings.workers,
+                                          exact_max_seats=sim_settings.exact_max_seats,
+                                          exact_max_nodes=sim_settings.exact_max_nodes,
+                                          trial_time_limit=sim_settings.trial_time_limit,
+                                          initializer=sim_settings.initializer,
+                                          collect_stats=sim_settings.collect_stats,
+                                          seed=sim_settings.seed,
+                                          optimizer_options=sim_settings.get_optimizer_options())
+
+        trials = sim_settings.trials
+
+        # Stop early once the best energy plateaus, the time budget runs out or a seating is proven optimal
+        scheduler = trial_runner.TrialScheduler(trials, patience=sim_settings.plateau_trials,
+                                                time_budget=sim_settings.time_budget)
+
+        # Trials run in the worker processes and the event loop polls for finished ones,
+        # so the window keeps working (e.g. to look at another trip) while a trip is seated
+        simulation = {'trip': trip,
+                      'layout_file': boat_layout_file,
+                      'passengers': passengers,
+                      'boat_graph': boat_graph,
+                      'sim': sim,
+                      'sim_settings': sim_settings,
+                      'cache': cache,
+                      'runner': runner,
+                      'scheduler': scheduler,
+                      'trials': trials,
+                      'trials_done': 0,
+                      'energy': 0xFFFFFFFF,
+                      'seats': None,
+                      'start_time': time.monotonic()}
+
+        # Start from the cached chart of an earlier version of the manifest, so the
+        # scheduler only has to run until the remaining trials stop improving on it
+        # (polished by the first trial queued on the worker pool)
+        warm_seats = cache.find_warm_start(passengers, boat_graph, sim_settings)
+        runner.start(sim_settings.trials, start_seats=warm_seats)
+        self._simulation = simulation
+
         self._progress_window = Toplevel()
         self._progress_window.title("Simulation Progress")
-        self._progress_window.geometry("320x100")
+        self._progress_window.geometry("320x130")
         self._progress_window.protocol("WM_DELETE_WINDOW", self._destroy_sim_progress)
-        self._progress_window.grab_set()
 
-        progress_window_percent = Message(self._progress_window,
-                                          text="0%",
-                                          width=100)
-        progress_window_percent.pack()
-        progress_window_msg = Message(self._progress_window,
-                                      text="0/%d Simulations" % settings_file.get_sim_settings().trials,
-                                      width=200)
-        progress_window_msg.pack()
+        self._progress_percent = Message(self._progress_window, text="0%", width=100)
+        self._progress_percent.pack()
+        self._progress_msg = Message(self._progress_window, text="0/%d Simulations" % trials, width=200)
+        self._progress_msg.pack()
+        self._progress_rate = Message(self._progress_window, text="", width=300)
+        self._progress_rate.pack()
 
-        progress_bar = Progressbar(self._progress_window, orient=HORIZONTAL, length=300, mode='determinate')
-        progress_bar['maximum'] = settings_file.get_sim_settings().trials
-        progress_bar.pack(pady=10)
-        progress_val = 0
-        progress_bar['value'] = progress_val
-        progress_bar.update_idletasks()
+        self._progress_bar = Progressbar(self._progress_window, orient=HORIZONTAL, length=300, mode='determinate')
+        self._progress_bar['maximum'] = trials
+        self._progress_bar['value'] = 0
+        self._progress_bar.pack(pady=10)
 
-        self._progress_window.update()
-        self._progress_window.update_idletasks()
+        self.after(progress_interval, self._poll_simulation, simulation)
 
-        passengers = trip.get_passengers()
-        test_passengers = copy.deepcopy(passengers)
+    def _poll_simulation(self, simulation):
+        if simulation is not self._simulation:
+            # Aborted
+            return
 
-        boat_graph = boat_init_graph_function(boat_img)
+        runner = simulation['runner']
+        scheduler = simulation['scheduler']
 
         try:
-            sim = ps.Simulation(boat_graph, test_passengers, repulsive_force, attractive_force, orphan_penalty)
-        except IndexError as e:
-            messagebox.showerror('Error', 'There are more passengers than seats!')
+            results = runner.poll()
+        except Exception as e:
+            print(e)
+            runner.abort()
+            self._simulation = None
             self._progress_window.destroy()
+            messagebox.showerror('Error', 'The simulation failed: %s' % e)
             return
 
-        min_energy = 0xFFFFFFFF
-        result_img = None
-
-        job_queue = queue.Queue()
-        result_queue = queue.Queue()
-
-        for progress_val in range(settings_file.get_sim_settings().trials):
-            job_queue.put(progress_val)
-
-        threads = []
-        for i  in range(NUM_THREADS):
-            thread = threading.Thread(target=particle_sim_thread,
-                                      args=(
-                                          copy.deepcopy(test_passengers),
-                                          copy.deepcopy(boat_graph),
-                                          job_queue,
-                                          result_queue
-                                      ))
-            threads.append(thread)
-
-        for thread in threads:
-            thread.start()
-
-        for i in range(settings_file.get_sim_settings().trials):
-            result = result_queue.get()
-
-            try:
-                progress_bar['value'] = i + 1
-                progress_window_percent.configure(text="%.2f%%" %(float(i) / float(settings_file.get_sim_settings().trials) * 100.0))
-                progress_window_msg.configure(text="%d/%d Simulations" % (i, settings_file.get_sim_settings().trials))
-                progress_bar.update_idletasks()
-                self._progress_window.update()
-                self._progress_window.update_idletasks()
-
-            except TclError as e:
-                # The window was destroyed
-                # Halt the simulation
-
-                # Clear job queue
-                while not job_queue.empty():
-                    job_num = job_queue.get()
-
-                # Join all threads
-                for thread in threads:
-                    thread.join()
-
-                messagebox.showwarning('Warning', 'Simulation Aborted')
-                return
-
-            # Check is_interesting_result flag
-            if result[0]:
-                energy = result[1]
-                img = result[2]
-                particle_result = result[3]
-
-                if energy < min_energy:
-                    min_energy = energy
-                    result_img = img
-
-                    # Update master list positions
-                    passenger_list = list(passengers)
-                    for particle in particle_result:
-                        for passenger in passenger_list:
-                            if particle == passenger:
-                                passenger.position = copy.copy(particle.position)
-                                passenger_list.remove(passenger)
-                                break
-
-        for thread in threads:
-            thread.join()
-
-        self._progress_window.destroy()
-        cv2.imwrite(result_img_name, result_img)
-        self._load_img(result_img_name)
-        self._update_results()
-
-
-def particle_sim_thread(particles, node_graph, job_queue, result_queue):
-    particle_results = copy.deepcopy(particles)
-    min_energy = 0xFFFFFFFF
-
-    sim = ps.Simulation(node_graph, particles, repulsive_force, attractive_force, orphan_penalty)
+        # Every trial collected by this poll counts, even past the point where the scheduler stops
+        for energy, seats in results:
+            simulation['trials_done'] += 1
+            if energy < simulation['energy']:
+                simulation['energy'] = energy
+                simulation['seats'] = seats
+            scheduler.add_result(energy)
 
-    while not job_queue.empty():
-        job_num = job_queue.get()
-        sim.init_particles()
+        if runner.optimal:
+            scheduler.set_optimal()
 
-        energy, result_particles = sim.run_sim(show_result=False, max_iterations=50, debug=False)
+        if simulation['seats'] is None and not runner.is_running():
+            self._simulation = None
+            self._progress_window.destroy()
+            messagebox.showerror('Error', 'No simulation trial finished')
+            return
 
-        if energy < min_energy:
-            min_energy = energy
-            result_img = node_graph.get_graph_image()
+        # Keep waiting for the first result, even once the time budget has run out
+        if simulation['seats'] is not None and (scheduler.should_stop() or not runner.is_running()):
+            self._finish_simulation(simulation)
+            return
 
-            result = (True, energy, copy.deepcopy(result_img), copy.deepcopy(result_particles))
-        else:
-            result = (False,)
+        # Every trial that finished since the last frame is shown in one update
+        done = simulation['trials_done']
+        self._progress_bar['value'] = done
+        self._progress_percent.configure(text="%.2f%%" % (float(done) / float(simulation['trials']) * 100.0))
+        self._progress_msg.configure(text="%d/%d Simulations" % (done, simulation['trials']))
+        if simulation['seats'] is not None:
+            elapsed = time.monotonic() - simulation['start_time']
+            self._progress_rate.configure(text="%.1f trials/s, best energy %.3f" %
+                                               (done / elapsed, simulation['energy']))
+
+        self.after(progress_interval, self._poll_simulation, simulation)
+
+    def _finish_simulation(self, simulation):
+        # Drop the trials the scheduler no longer needs
+        simulation['runner'].abort()
+        self._simulation = None
+        self._progress_window.destroy()
 
-        result_queue.put(result)
+        boat_graph = simulation['boat_graph']
+        simulation['cache'].store(simulation['passengers'], boat_graph, simulation['sim_settings'],
+                                  simulation['energy'], simulation['seats'])
+        if simulation['runner'].stats is not None:
+            simulation['runner'].stats.save(result_stats_name)
 
+        if simulation['trip'] is not trip or simulation['layout_file'] != boat_layout_file:
+            # Another trip or boat was loaded while this one was seated, the result waits in the cache
+            messagebox.showinfo('Simulation', "Finished seating the %s departure. Load it again and run the"
+                                              " simulation to see the chart." % simulation['trip'].ride_date)
+            return
 
-    # Cleanup after thread
-    del particle_results
-    del min_energy
-    del sim
+        summary = "%s, seed %d" % (simulation['scheduler'].get_summary(), simulation['runner'].seed)
+        self._show_result(simulation['sim'], simulation['seats'], summary)
 
+    def _show_result(self, sim, seats, summary):
+        # Update master list positions and render the winning chart (once)
+        sim.set_seats(seats)
+        cv2.imwrite(result_img_name, sim.get_image())
+        self._load_img(result_img_name)
+        self._update_results()
+        self.result_list.insert(0, summary)
 
 
 def display_settings():
     global settings_file, settings_window, settings_max_itr_var, \
         settings_trials_var, settings_rep_f_var, settings_attr_f_var, \
-        settings_orphan_f_var
+        settings_orphan_f_var, settings_workers_var, settings_optimizer_var, settings_time_limit_var, \
+        settings_initializer_var, settings_time_budget_var, settings_plateau_var
 
     settings_window = Toplevel()
     settings_window.title("Settings")
@@ -356,6 +444,12 @@ def display_settings():
     settings_attr_f_var.set(str(sim_settings.attractive_force))
     settings_rep_f_var.set(str(sim_settings.repulsive_force))
     settings_orphan_f_var.set(str(sim_settings.orphan_penalty))
+    settings_workers_var.set(str(sim_settings.workers))
+    settings_optimizer_var.set(sim_settings.optimizer)
+    settings_time_limit_var.set(str(sim_settings.trial_time_limit))
+    settings_initializer_var.set(sim_settings.initializer)
+    settings_time_budget_var.set(str(sim_settings.time_budget))
+    settings_plateau_var.set(str(sim_settings.plateau_trials))
 
     trials_entry = Entry(frame, width=7, textvariable=settings_trials_var)
     trials_entry.grid(column=2, row=1, sticky=E)
@@ -372,14 +466,38 @@ def display_settings():
     orphan_penalty_entry = Entry(frame, width=7, textvariable=settings_orphan_f_var)
     orphan_penalty_entry.grid(column=2, row=5, sticky=E)
 
+    workers_entry = Entry(frame, width=7, textvariable=settings_workers_var)
+    workers_entry.grid(column=2, row=6, sticky=E)
+
+    optimizer_entry = Entry(frame, width=10, textvariable=settings_optimizer_var)
+    optimizer_entry.grid(column=2, row=7, sticky=E)
+
+    time_limit_entry = Entry(frame, width=7, textvariable=settings_time_limit_var)
+    time_limit_entry.grid(column=2, row=8, sticky=E)
+
+    initializer_entry = Entry(frame, width=10, textvariable=settings_initializer_var)
+    initializer_entry.grid(column=2, row=9, sticky=E)
+
+    time_budget_entry = Entry(frame, width=7, textvariable=settings_time_budget_var)
+    time_budget_entry.grid(column=2, row=10, sticky=E)
+
+    plateau_entry = Entry(frame, width=7, textvariable=settings_plateau_var)
+    plateau_entry.grid(column=2, row=11, sticky=E)
+
     Label(frame, text="Trials:").grid(column=1, row=1, sticky=W)
     Label(frame, text="Max Iterations:").grid(column=1, row=2, sticky=W)
     Label(frame, text="Attractive Force:").grid(column=1, row=3, sticky=W)
     Label(frame, text="Repulsive Force:").grid(column=1, row=4, sticky=W)
     Label(frame, text="Orphan Penalty:").grid(column=1, row=5, sticky=W)
+    Label(frame, text="Workers (0 = all cores):").grid(column=1, row=6, sticky=W)
+    Label(frame, text="Optimizer (%s):" % ", ".join(ps.OPTIMIZERS)).grid(column=1, row=7, sticky=W)
+    Label(frame, text="Trial Time Limit (s, 0 = none):").grid(column=1, row=8, sticky=W)
+    Label(frame, text="Initializer (%s):" % ", ".join(ps.INITIALIZERS)).grid(column=1, row=9, sticky=W)
+    Label(frame, text="Time Budget (s, 0 = none):").grid(column=1, row=10, sticky=W)
+    Label(frame, text="Plateau Trials (0 = none):").grid(column=1, row=11, sticky=W)
 
-    Button(frame, text="Save", command=save_settings).grid(column=1, row=6, sticky=W)
-    Button(frame, text="Cancel", command=settings_window.destroy).grid(column=2, row=6, sticky=E)
+    Button(frame, text="Save", command=save_settings).grid(column=1, row=12, sticky=W)
+    Button(frame, text="Cancel", command=settings_window.destroy).grid(column=2, row=12, sticky=E)
 
     for child in frame.winfo_children(): child.grid_configure(padx=5, pady=5)
 
@@ -387,7 +505,8 @@ def display_settings():
 def save_settings(*args):
     global settings_file, settings_window, settings_max_itr_var, \
         settings_trials_var, settings_rep_f_var, settings_attr_f_var, \
-        settings_orphan_f_var
+        settings_orphan_f_var, settings_workers_var, settings_optimizer_var, settings_time_limit_var, \
+        settings_initializer_var, settings_time_budget_var, settings_plateau_var
 
     sim_settings = settings_file.get_sim_settings()
 
@@ -397,23 +516,52 @@ def save_settings(*args):
         tmp_repulsive_force = float(settings_rep_f_var.get())
         tmp_attractive_force = float(settings_attr_f_var.get())
         tmp_orphan_penalty = float(settings_orphan_f_var.get())
+        tmp_workers = int(settings_workers_var.get())
+        tmp_optimizer = settings_optimizer_var.get().strip()
+        tmp_time_limit = float(settings_time_limit_var.get())
+        tmp_initializer = settings_initializer_var.get().strip()
+        tmp_time_budget = float(settings_time_budget_var.get())
+        tmp_plateau_trials = int(settings_plateau_var.get())
 
         assert tmp_max_iterations > 0
         assert tmp_trials > 0
+        assert tmp_workers >= 0
+        assert tmp_time_limit >= 0
+        assert tmp_time_budget >= 0
+        assert tmp_plateau_trials >= 0
+
+        if tmp_optimizer not in ps.OPTIMIZERS:
+            raise KeyError(tmp_optimizer)
+
+        if tmp_initializer not in ps.INITIALIZERS:
+            raise KeyError(tmp_initializer)
 
         sim_settings.max_iterations = tmp_max_iterations
         sim_settings.trials = tmp_trials
         sim_settings.repulsive_force = tmp_repulsive_force
         sim_settings.attractive_force = tmp_attractive_force
         sim_settings.orphan_penalty = tmp_orphan_penalty
+        sim_settings.workers = tmp_workers
+        sim_settings.optimizer = tmp_optimizer
+        sim_settings.trial_time_limit = tmp_time_limit
+        sim_settings.initializer = tmp_initializer
+        sim_settings.time_budget = tmp_time_budget
+        sim_settings.plateau_trials = tmp_plateau_trials
 
     except ValueError as e:
         messagebox.showerror(title="ERROR", message="One or more values are not numbers!"
                                                             " Double check all entries before saving")
         return
 
+    except KeyError as e:
+        messagebox.showerror(title="ERROR", message="Unknown optimizer or initializer! Use one of: %s and %s" %
+                                                    (", ".join(ps.OPTIMIZERS), ", ".join(ps.INITIALIZERS)))
+        return
+
     except AssertionError as e:
-        messagebox.showerror(title="ERROR", message="Max Iterations and Trials must be positive numbers")
+        messagebox.showerror(title="ERROR", message="Max Iterations and Trials must be positive numbers"
+                                                    " and Workers, Trial Time Limit, Time Budget and Plateau Trials"
+                                                    " can't be negative")
         return
 
     settings_file.update_sim_settings(sim_settings)
@@ -422,23 +570,19 @@ def save_settings(*args):
 
 
 def on_closing():
-    if messagebox.askokcancel("Quit", "Do you want to quit?"):
-        root.destroy()
+    app._exit_program()
 
 
 def set_boat(boat):
-    global trip, boat_img, boat_init_graph_function
+    global trip, boat_img, boat_layout_file
     boat_img = boat.image_file
-
-    if boat.id == 1:
-        boat_init_graph_function = bucket_model.init_rouge_wave_graph
-    if boat.id == 2:
-        boat_init_graph_function = graph.init_gale_force_graph
-    if boat.id == 3:
-        boat_init_graph_function = graph.init_island_girl_graph
+    boat_layout_file = boat.layout_file
 
 
 if __name__ == '__main__':
+    # Trials run in worker processes (required for frozen Windows builds)
+    multiprocessing.freeze_support()
+
     root = Tk()
     app = Window(root)
 
@@ -447,6 +591,12 @@ if __name__ == '__main__':
     settings_rep_f_var = StringVar()
     settings_attr_f_var = StringVar()
     settings_orphan_f_var = StringVar()
+    settings_workers_var = StringVar()
+    settings_optimizer_var = StringVar()
+    settings_time_limit_var = StringVar()
+    settings_initializer_var = StringVar()
+    settings_time_budget_var = StringVar()
+    settings_plateau_var = StringVar()
 
     settings_window = None
 
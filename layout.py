@@ -0,0 +1,86 @@
+import json
+import os
+
+import bucket_model
+
+
+# Layouts loaded by this process, keyed by file name
+_layouts = dict()
+
+
+def get_layout(file_name):
+    """
+    Get a boat layout, reading the layout file only once per process (or again if it changed on disk)
+    :param file_name: the boat's layout file
+    :return: the Layout
+    """
+    modified = os.path.getmtime(file_name)
+
+    if file_name not in _layouts or _layouts[file_name].modified != modified:
+        _layouts[file_name] = Layout(file_name)
+    return _layouts[file_name]
+
+
+def get_boat_graph(boat):
+    """
+    Build the seat graph of a boat
+    :param boat: the boat's BoatSettings
+    :return: a BucketModel
+    """
+    return get_layout(boat.layout_file).create_graph(boat.image_file)
+
+
+class Seat:
+    def __init__(self, name, position, row, is_port, front_seat):
+        self.name = name
+        self.position = position
+        self.row = row
+        self.is_port = is_port
+        self.front_seat = front_seat
+
+
+class Layout:
+    """
+    The seats of a boat, read from a layout file:
+        {"rows": [{"row": 1, "x": 725, "front": true,
+                   "port": {"A1": 146, "A2": 206},
+                   "starboard": {"A3": 352, "A4": 412}}, ...]}
+    Rows are numbered from the front of the boat, x is the row's position and each side maps seat names to
+    their position along the row (both on the boat image rotated 90 degrees clockwise).
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.modified = os.path.getmtime(file_name)
+        self.seats = list()
+
+        with open(file_name, 'r') as file:
+            data = json.load(file)
+
+        for row in data['rows']:
+            for side in (bucket_model.PORT, bucket_model.STARBOARD):
+                for name, y in row.get(side, dict()).items():
+                    self.seats.append(Seat(name, (row['x'], y), row['row'], side == bucket_model.PORT,
+                                           row.get('front', False)))
+
+        # Seat matrices are computed once and shared by every graph of this layout
+        self._template = self._build_graph(None)
+        self._template.get_node_names()
+
+    def _build_graph(self, image_file):
+        buckets = bucket_model.BucketModel(image_file)
+
+        for seat in self.seats:
+            buckets.add_node(seat.name, seat.position, row=seat.row, is_port=seat.is_port,
+                             front_seat=seat.front_seat)
+        return buckets
+
+    def create_graph(self, image_file):
+        """
+        Build a graph of the layout drawn on a boat image
+        :param image_file: the boat's image file
+        :return: a BucketModel
+        """
+        buckets = self._build_graph(image_file)
+        buckets.share_matrices(self._template)
+        return buckets
@@ -1,7 +1,14 @@
+import itertools
+import json
 import random
-import copy
+import time
 import numpy as np
-from uuid import uuid4
+
+import bucket_model
+
+
+# Force applied between two particles that share a seat
+OVERLAP_FORCE = 10000
 
 
 def triangle_wave(x, p, max, min):
@@ -10,7 +17,7 @@ def triangle_wave(x, p, max, min):
     return ((2.0*a)/p) * abs( (x % p) - (p/2.0) ) - ((2.0*a)/4.0) + offset
 
 
-def get_n_distinct_group_colors(n):
+def get_n_distinct_group_colors(n, rng=random):
     hues = np.arange(0, 255, (255//n))
 
     colors = []
@@ -23,8 +30,8 @@ def get_n_distinct_group_colors(n):
     fills = list(colors)
     strokes = list(colors)
 
-    random.shuffle(fills)
-    random.shuffle(strokes)
+    rng.shuffle(fills)
+    rng.shuffle(strokes)
 
     result = []
     for i in range(len(fills)):
@@ -32,207 +39,659 @@ def get_n_distinct_group_colors(n):
     return result
 
 
+def get_trial_seed(master_seed, trial):
+    """
+    Get the seed of one trial of a run, so a trial gives the same chart however the trials are split
+    between worker processes
+    :param master_seed: the run's seed
+    :param trial: the trial's index in the run
+    :return: an integer seed (see Simulation.seed)
+    """
+    sequence = np.random.SeedSequence(master_seed, spawn_key=(trial,))
+    return int.from_bytes(sequence.generate_state(4).tobytes(), 'little')
+
+
 class Particle:
+    __slots__ = ('group', 'is_child', 'position')
+
     def __init__(self, group, is_child=False, position=None):
         self.group = group
         self.position = position
         self.is_child = is_child
-        self._id = uuid4()
 
-    def __eq__(self, other):
-        result = False
 
-        if isinstance(other, Particle):
-            result = other._id == self._id
-        return result
+class PassengerState:
+    """
+    Struct-of-arrays state of every passenger on a trip
+        seats[i]: seat index of passenger i (-1 while unseated)
+        group_ids[i]: index of passenger i's group in group_names
+        is_child[i]: True if passenger i is a child
+    """
+    __slots__ = ('group_names', 'group_ids', 'is_child', 'seats')
+
+    def __init__(self, group_names, group_ids, is_child, seats=None):
+        self.group_names = list(group_names)
+        self.group_ids = np.asarray(group_ids, dtype=int)
+        self.is_child = np.asarray(is_child, dtype=bool)
 
-    def __ne__(self, other):
-        return not self.__eq__(other)
+        if seats is None:
+            seats = np.full(len(self.group_ids), -1, dtype=int)
+        self.seats = np.asarray(seats, dtype=int)
+
+    @classmethod
+    def from_particles(cls, particles):
+        """
+        Build the state of a list of particles (passenger i is particles[i])
+        :param particles: an iterable of Particles
+        :return: a PassengerState
+        """
+        group_indices = dict()
+        group_ids = list()
+        is_child = list()
+
+        for particle in particles:
+            if particle.group not in group_indices:
+                group_indices[particle.group] = len(group_indices)
+            group_ids.append(group_indices[particle.group])
+            is_child.append(particle.is_child)
+
+        return cls(list(group_indices), group_ids, is_child)
+
+    def __len__(self):
+        return len(self.group_ids)
+
+    def copy(self):
+        return PassengerState(self.group_names, self.group_ids.copy(), self.is_child.copy(), self.seats.copy())
+
+
+class EnergyQueue:
+    """
+    Indexed priority queue of particles, highest energy first
+    Particles with equal energies are ordered by index so none are ever dropped
+    """
+
+    def __init__(self, energies):
+        self._energies = np.array(energies, dtype=float)
+        self._heap = list(range(len(self._energies)))
+        self._heap.sort(key=lambda particle: (-self._energies[particle], particle))
+        self._positions = dict()
+        for i, particle in enumerate(self._heap):
+            self._positions[particle] = i
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __contains__(self, particle):
+        return particle in self._positions
+
+    def __iter__(self):
+        return iter(list(self._heap))
+
+    def _before(self, a, b):
+        ea = self._energies[a]
+        eb = self._energies[b]
+        return ea > eb or (ea == eb and a < b)
+
+    def _swap(self, i, j):
+        heap = self._heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self._positions[heap[i]] = i
+        self._positions[heap[j]] = j
+
+    def _sift_up(self, i):
+        while i > 0:
+            parent = (i - 1) // 2
+            if not self._before(self._heap[i], self._heap[parent]):
+                break
+            self._swap(i, parent)
+            i = parent
+
+    def _sift_down(self, i):
+        size = len(self._heap)
+        while True:
+            first = i
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < size and self._before(self._heap[child], self._heap[first]):
+                    first = child
+            if first == i:
+                break
+            self._swap(i, first)
+            i = first
+
+    def pop(self):
+        """
+        Remove and return the particle with the highest energy
+        :return: the particle's index
+        """
+        top = self._heap[0]
+        self._swap(0, len(self._heap) - 1)
+        self._heap.pop()
+        del self._positions[top]
+
+        if len(self._heap) > 0:
+            self._sift_down(0)
+        return top
+
+    def update(self, particle, energy):
+        """
+        Change the energy of a queued particle (increase or decrease key)
+        :param particle: the particle's index
+        :param energy: the particle's new energy
+        :return: None
+        """
+        old_energy = self._energies[particle]
+        self._energies[particle] = energy
+
+        if energy > old_energy:
+            self._sift_up(self._positions[particle])
+        elif energy < old_energy:
+            self._sift_down(self._positions[particle])
+
+
+class SimulationStats:
+    """
+    Opt-in instrumentation of a Simulation (see Simulation.set_stats)
+        counters: calls of the hot paths (forces, energies, orphan penalties, move evaluations, moves)
+        timings: seconds spent in each phase of run_iteration, run_sim and rendering
+        trials: the iteration count, energy and duration of every trial
+    """
+
+    def __init__(self, callback=None):
+        """
+        :param callback: [Optional] called with the stats after every trial
+        """
+        self.counters = dict()
+        self.timings = dict()
+        self.trials = list()
+        self._callback = callback
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def add_time(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def lap(self, name, start):
+        """
+        Add the time since start to a phase
+        :param name: the phase
+        :param start: a time.perf_counter() time
+        :return: the current time.perf_counter() time (the start of the next phase)
+        """
+        now = time.perf_counter()
+        self.add_time(name, now - start)
+        return now
 
-    def __hash__(self):
-        return hash(self._id)
+    def add_trial(self, iterations, energy, seconds):
+        self.trials.append({'iterations': iterations, 'energy': float(energy), 'seconds': seconds})
+
+        if self._callback is not None:
+            self._callback(self)
+
+    def merge(self, data):
+        """
+        Add the stats of another run (e.g. from a worker process)
+        :param data: a dictionary from get_data
+        :return: None
+        """
+        for name, amount in data['counters'].items():
+            self.count(name, amount)
+        for name, seconds in data['timings'].items():
+            self.add_time(name, seconds)
+        for trial in data['trials']:
+            self.add_trial(trial['iterations'], trial['energy'], trial['seconds'])
+
+    def get_data(self):
+        return {'counters': dict(self.counters),
+                'timings': dict(self.timings),
+                'trials': list(self.trials)}
+
+    def save(self, file_name):
+        with open(file_name, 'w') as file:
+            json.dump(self.get_data(), file, indent=2)
 
 
 class Simulation:
 
     def __init__(self, graph, particles, repulsion_factor, attraction_factor, orphan_penalty):
+        """
+        :param graph: the boat's graph
+        :param particles: the passengers to seat (a list of Particles or a PassengerState)
+        :param repulsion_factor: force factor between particles of different groups
+        :param attraction_factor: force factor between particles of the same group
+        :param orphan_penalty: penalty for a child seated away from its group's adults
+        """
         self._graph = graph
         self._particles = particles
         self._repulsion_factor = repulsion_factor
         self._attraction_factor = attraction_factor
         self._orphan_penalty = orphan_penalty
 
-        distances = set()
-        for node_a in self._graph.get_nodes():
-            for node_b in self._graph.get_nodes():
+        # Seat-index matrices shared by every energy evaluation
+        self._seat_names = graph.get_node_names()
+        self._distances = graph.get_distance_matrix()
+        self._inverse_square_distances = graph.get_inverse_square_matrix()
+        self._directions = graph.get_direction_matrix()
+        self._front_seats = graph.get_front_seat_mask()
 
-                if node_a == node_b:
-                    continue
+        distances = np.unique(self._distances[~np.eye(len(self._seat_names), dtype=bool)])
+        self._min_node_distances = [distances[0], distances[1]]
 
-                distances.add(graph.get_weight(node_a, node_b))
+        # Particles are referenced by index into the passenger state arrays
+        if isinstance(particles, PassengerState):
+            self._particle_list = None
+            self._state = particles
+        else:
+            self._particle_list = list(particles)
+            self._state = PassengerState.from_particles(self._particle_list)
 
-        distances = list(distances)
-        distances.sort()
-        self._min_node_distances = [distances[0], distances[1]]
+        self._group_names = self._state.group_names
+        self._group_ids = self._state.group_ids
+        self._is_child = self._state.is_child
+        self._seats = self._state.seats
 
         self._groups = dict()
-        for particle in self._particles:
+        for group_id in range(len(self._group_names)):
+            members = self._group_ids == group_id
+            self._groups[group_id] = (np.flatnonzero(members & ~self._is_child),
+                                      np.flatnonzero(members & self._is_child))
+        self._group_sizes = np.bincount(self._group_ids, minlength=len(self._group_names))
 
-            if particle.group not in self._groups:
-                self._groups[particle.group] = (list(), list())
+        self._occupation_map = np.zeros(len(self._seat_names), dtype=bool)
 
-            if particle.is_child:
-                self._groups[particle.group][1].append(particle)
-            else:
-                self._groups[particle.group][0].append(particle)
+        # Pinned particles keep their seats (see pin_particles)
+        self._pinned = np.zeros(len(self._seats), dtype=bool)
+
+        # Iterations run by the last call to run_sim
+        self.iterations = 0
+
+        # Sweeps (one move per unpinned particle) run by the last call to run_annealing, before its run_sim polish
+        self.annealing_sweeps = 0.0
 
-        self._occupation_map = dict()
-        for node in self._graph.get_nodes():
-            self._occupation_map[node] = False
+        # Instrumentation (off unless set_stats is called)
+        self._stats = None
 
-    def init_particles(self):
+        # Every random choice of this simulation comes from its own generator (see seed)
+        self._seed = None
+        self._random = random.Random()
+
+        # Group colors, chosen when the first image is drawn (see get_image)
+        self._group_colors = None
+
+        # Incremental energy state (see _reset_energy_cache)
+        self._group_fields = None
+        self._total_field = None
+        self._group_penalties = None
+        self._energies = None
+
+    def init_particles(self, seats=None):
         """
         Set random positions for all the particles
+        :param seats: [Optional] seat indices to keep (e.g. a cached layout), -1 for particles to place randomly
         :return:
         """
-        nodes = list(self._graph.get_nodes())
-        random.shuffle(nodes)
+        nodes = list(range(len(self._seat_names)))
+        self._random.shuffle(nodes)
 
-        if len(nodes) < len(self._particles):
+        if len(nodes) < len(self._seats):
             raise IndexError("More Passengers Than Seats")
 
-        for particle in self._particles:
-            node = nodes.pop()
-            particle.position = node
+        if seats is None:
+            seats = np.full(len(self._seats), -1, dtype=int)
+        kept = set(seat for seat in seats.tolist() if seat >= 0)
+        nodes = [node for node in nodes if node not in kept]
+
+        self._occupation_map[:] = False
+        for i in range(len(self._seats)):
+            node = seats[i] if seats[i] >= 0 else nodes.pop()
+            self._seats[i] = node
             self._occupation_map[node] = True
-        self._update_image()
+        self._reset_energy_cache()
+        self._sync_particles()
+
+    def init_buckets(self):
+        """
+        Place whole groups into the boat's row buckets (a randomized greedy bin packing)
+            1. Take the groups largest first (in random order among groups of the same size)
+            2. Seat each group in the run of free seats in one bucket that is furthest from the groups
+               already seated (groups with children skip the front seats)
+            3. Spread groups too big for any bucket over neighbouring rows of one side, children in the back rows
+            4. Split the group's seats between adults and children with the lowest orphan penalty
+            5. Seat anyone left over at random
+        Falls back to init_particles if the graph has no buckets
+        :return:
+        """
+        if not isinstance(self._graph, bucket_model.BucketModel):
+            self.init_particles()
+            return
+
+        if len(self._seat_names) < len(self._seats):
+            raise IndexError("More Passengers Than Seats")
+
+        seats = np.full(len(self._seats), -1, dtype=int)
+        occupied = np.zeros(len(self._seat_names), dtype=bool)
+
+        # Repulsion felt at every seat from the passengers seated so far
+        field = np.zeros(len(self._seat_names))
+
+        order = list(range(len(self._group_names)))
+        self._random.shuffle(order)
+        order.sort(key=lambda group: -self._group_sizes[group])
+
+        for group in order:
+            adults, children = self._groups[group]
+
+            best = None
+            for window in self._get_bucket_windows(len(adults) + len(children), len(children), occupied):
+                # The noise makes every trial start from a different layout
+                cost = (field[window].sum() + 1e-9) * self._random.uniform(1.0, 2.0)
+                if best is None or cost < best[0]:
+                    best = (cost, window)
+
+            if best is None:
+                continue
+
+            adult_seats, child_seats = self._split_group_seats(best[1], len(adults), len(children))
+            seats[adults] = adult_seats
+            seats[children] = child_seats
+            occupied[best[1]] = True
+            field += self._inverse_square_distances[best[1]].sum(axis=0)
+
+        # Groups that didn't fit anywhere: children take the free seats outside the front rows first
+        free = np.flatnonzero(~occupied).tolist()
+        self._random.shuffle(free)
+        free.sort(key=lambda seat: self._front_seats[seat])
+
+        for particle in np.flatnonzero(seats < 0):
+            seats[particle] = free.pop(0) if self._is_child[particle] else free.pop()
+
+        self.set_seats(seats)
+
+    def _get_bucket_windows(self, size, children, occupied):
+        """
+        Get the seats a group could take: runs of free seats in one bucket or, for groups too big for every
+        bucket, the free seats of neighbouring rows on one side of the boat (children in the back rows)
+        :param size: the number of passengers in the group
+        :param children: the number of children in the group
+        :param occupied: a boolean array, True for taken seat indices
+        :return: a list of seat index arrays
+        """
+        port_buckets, stbd_buckets = self._graph.get_bucket_lists()
+
+        windows = list()
+        for bucket in port_buckets + stbd_buckets:
+            if children > 0 and bucket.is_front:
+                continue
+
+            free = self._graph.get_free_seats(bucket.side, bucket.row, occupied)
+            for start in range(len(free) - size + 1):
+                windows.append(free[start:start + size])
+
+        if len(windows) > 0:
+            return windows
+
+        for buckets in (port_buckets, stbd_buckets):
+            for start in range(len(buckets)):
+                rows = list()
+
+                for bucket in buckets[start:]:
+                    rows.append(self._graph.get_free_seats(bucket.side, bucket.row, occupied))
+                    row_seats = np.concatenate(rows)
+
+                    if len(row_seats) >= size:
+                        back_seats = row_seats[~self._front_seats[row_seats]]
+
+                        if len(back_seats) >= children:
+                            child_seats = back_seats[len(back_seats) - children:]
+                            adult_seats = row_seats[~np.isin(row_seats, child_seats)][:size - children]
+                            windows.append(np.concatenate([adult_seats, child_seats]))
+                        break
+
+        return windows
+
+    def _split_group_seats(self, window, adults, children):
+        """
+        Choose which of a group's seats the adults take (children stay out of the front seats if they can)
+        :param window: the group's seat indices
+        :param adults: the number of adults in the group
+        :param children: the number of children in the group
+        :return: the adult and child seat indices
+        """
+        if adults == 0 or children == 0:
+            return window[:adults], window[adults:]
+
+        splits = list(itertools.combinations(range(len(window)), adults))
+        if len(splits) > 256:
+            return window[:adults], window[adults:]
+
+        adult_masks = np.zeros((len(splits), len(window)), dtype=bool)
+        for i, split in enumerate(splits):
+            adult_masks[i, list(split)] = True
+
+        layouts = np.broadcast_to(window, adult_masks.shape)
+        adult_seats = layouts[adult_masks].reshape(len(splits), adults)
+        child_seats = layouts[~adult_masks].reshape(len(splits), children)
+
+        costs = self._get_orphan_penalties(child_seats, adult_seats)
+        costs += 99999 * self._front_seats[child_seats].sum(axis=1)
+
+        best = self._random.choice(np.flatnonzero(costs == costs.min()).tolist())
+        return adult_seats[best], child_seats[best]
+
+    def get_seats(self):
+        """
+        Get the seat index of every particle (in particle order)
+        :return: an array of seat indices
+        """
+        return self._seats.copy()
+
+    def set_seats(self, seats):
+        """
+        Place every particle at the given seats (e.g. the result of a trial run elsewhere)
+        :param seats: an array of seat indices in particle order
+        :return: None
+        """
+        self._seats[:] = seats
+        self._occupation_map[:] = False
+        self._occupation_map[self._seats] = True
+        self._reset_energy_cache()
+        self._sync_particles()
+
+    def pin_particles(self, pinned):
+        """
+        Keep particles in their current seats while the others are optimized (e.g. passengers already
+        told where to sit). The particle and annealing optimizers never move a pinned particle.
+        :param pinned: a boolean array in particle order, True for particles that must not move
+        :return: None
+        """
+        self._pinned[:] = pinned
+
+    def seed(self, seed):
+        """
+        Restart the simulation's random generator, e.g. with get_trial_seed before each trial
+        The same seed, starting seats and settings give the same result (unless a deadline cuts the trial short)
+        :param seed: an integer seed, or None to seed from the operating system
+        :return: None
+        """
+        self._seed = seed
+        self._random.seed(seed)
+
+    def set_stats(self, stats):
+        """
+        Turn the instrumentation on (a SimulationStats) or off (None)
+        :return: None
+        """
+        self._stats = stats
+
+    def get_stats(self):
+        return self._stats
+
+    def _sync_particles(self):
+        """
+        Copy the seat indices back onto the particles as node names
+        :return: None
+        """
+        if self._particle_list is None:
+            return
+
+        for i, particle in enumerate(self._particle_list):
+            particle.position = self._seat_names[self._seats[i]]
 
     def _get_group_names(self):
-        return self._groups.keys()
+        return self._group_names
+
+    def _get_group_colors(self):
+        """
+        Get the (fill, stroke) colors of every group, chosen once so a group keeps its colors between images
+        :return: a list of colors indexed by group id
+        """
+        if self._group_colors is None:
+            available_colors = get_n_distinct_group_colors(len(self._group_names), random.Random(self._seed))
+            self._group_colors = [available_colors.pop() for _ in self._group_names]
+        return self._group_colors
 
     def _update_image(self):
         """
-        Update and display the image produced by the graph to show the current system
+        Color the graph's seats to show the current system
         :return: None
         """
+        group_colors = self._get_group_colors()
+
+        # The graph may be shared with other simulations, so every seat is cleared first
+        for node in self._seat_names:
+            self._graph.set_color(node, None, None)
 
-        particles = self._particles.copy()
-        group_colors = {}
+        for seat, group_id, is_child in zip(self._seats.tolist(), self._group_ids.tolist(), self._is_child.tolist()):
+            fill, stroke = group_colors[group_id]
+            self._graph.set_color(self._seat_names[seat], fill, stroke, accent=is_child)
 
-        groups = self._get_group_names()
-        available_colors = get_n_distinct_group_colors(len(groups))
-        for group in groups:
-            group_colors[group] = available_colors.pop()
+    def get_image(self):
+        """
+        Draw the current seats on the boat image
+        :return: the BGR image, overwritten by the next render (see Graph.get_graph_image)
+        """
+        if self._stats is not None:
+            start = time.perf_counter()
 
-        for node in self._graph.get_nodes():
-            self._graph.set_color(node, None, None)
+        self._update_image()
+        image = self._graph.get_graph_image()
 
-            for particle in particles:
+        if self._stats is not None:
+            self._stats.lap('render', start)
+        return image
 
-                if node == particle.position:
-                    self._graph.set_color(node,
-                                          group_colors[particle.group][0],
-                                          group_colors[particle.group][1],
-                                          accent=particle.is_child)
-                    particles.remove(particle)
-                    break
+    def _show_graph(self):
+        self._update_image()
+        self._graph.show_graph()
+
+    def _get_orphan_penalties(self, child_seats, adult_seats):
+        """
+        Get the orphan penalty of a group for several candidate layouts at once
+        Each child is scored against the closest adult in its group
+        :param child_seats: a (layouts, children) array of seat indices
+        :param adult_seats: a (layouts, adults) array of seat indices
+        :return: an array with the group's penalty for each layout
+        """
+        layouts, children = child_seats.shape
+
+        if self._stats is not None:
+            self._stats.count('orphan_penalty')
+            self._stats.count('orphan_penalty_layouts', layouts)
+
+        if children == 0:
+            return np.zeros(layouts)
+
+        if adult_seats.shape[1] == 0:
+            # Every child is orphaned
+            return np.full(layouts, children * self._orphan_penalty)
+
+        distances = self._distances[child_seats[:, :, np.newaxis], adult_seats[:, np.newaxis, :]]
+        nearest = distances.argmin(axis=2)
+        distance_from_adult = np.take_along_axis(distances, nearest[:, :, np.newaxis], axis=2)[:, :, 0]
+        nearest_adult = np.take_along_axis(adult_seats, nearest, axis=1)
+        behind_adult = self._directions[child_seats, nearest_adult, 0] < 0
+
+        # Adult and child are seated adjacent (no penalty)
+        # Child is one row from the adult (behind: half penalty, in front: quarter penalty)
+        # Child is Orphaned (full penalty)
+        weights = np.where(distance_from_adult <= self._min_node_distances[0], 0.0,
+                           np.where(distance_from_adult <= self._min_node_distances[1],
+                                    np.where(behind_adult, 0.5, 0.25),
+                                    1.0))
+
+        return self._orphan_penalty * weights.sum(axis=1)
+
+    def _get_move_penalties(self, particle, positions):
+        """
+        Get the orphan penalty of a particle's group with the particle moved to each of the given seats
+        :param particle: index of the particle
+        :param positions: an array of seat indices
+        :return: an array of penalties, one per position
+        """
+        group_adults, group_children = self._groups[self._group_ids[particle]]
+
+        child_seats = np.tile(self._seats[group_children], (len(positions), 1))
+        adult_seats = np.tile(self._seats[group_adults], (len(positions), 1))
+
+        if self._is_child[particle]:
+            child_seats[:, np.searchsorted(group_children, particle)] = positions
+        else:
+            adult_seats[:, np.searchsorted(group_adults, particle)] = positions
+
+        return self._get_orphan_penalties(child_seats, adult_seats)
 
     def _get_group_orphan_penalty(self, group, test_particle=None, test_particle_position=None):
-        penalty = 0
-
-        group_children = set(self._groups[group][1])
-        group_adults = set(self._groups[group][0])
-
-        # for particle in self._particles:
-        #
-        #     if group == particle.group:
-        #
-        #         if (particle == test_particle) and (test_particle_position is not None):
-        #             sample = Particle( particle.group, particle.is_child)
-        #             sample.position = test_particle_position
-        #         else:
-        #             sample = particle
-        #
-        #         if sample.is_child:
-        #             group_children.add(sample)
-        #         else:
-        #             group_adults.add(sample)
-
-        for child in group_children:
-            distance_from_adult = 9999999
-            vector = (0, 0)
-
-            for adult in group_adults:
-                dist = self._graph.get_weight(child.position, adult.position)
-                if dist < distance_from_adult:
-                    distance_from_adult = dist
-                    vector = self._graph.get_direction_vector(child.position, adult.position)
-
-            # Adult and child are seated adjacent (no penalty)
-            if distance_from_adult <= self._min_node_distances[0]:
-                pass
-            elif distance_from_adult <= self._min_node_distances[1]:
-
-                if vector[0] < 0:
-                    # Child is behind adult
-                    penalty += self._orphan_penalty * 0.5
-                else:
-                    # Child is in front of adult
-                    penalty += self._orphan_penalty * 0.25
-
-            # Child is Orphaned Apply Penalty
-            else:
-                penalty += self._orphan_penalty
+        if test_particle is not None and test_particle_position is not None:
+            return self._get_move_penalties(test_particle, np.array([test_particle_position]))[0]
 
-        return penalty
+        group_adults, group_children = self._groups[group]
+        return self._get_orphan_penalties(self._seats[group_children][np.newaxis, :],
+                                          self._seats[group_adults][np.newaxis, :])[0]
 
-    def _get_force(self, p1, p2):
+    def _get_forces(self, particle, position):
         """
-        Get the force (Culomb's law) between two particle
+        Get the force (Culomb's law) between a particle at a seat and every other particle
         [An attractive force has a negative magnitude]
-        :param p1: the first particle
-        :param p2: the second particle
-        :return: The singed force between the two particles
+        :param particle: index of the particle
+        :param position: seat index to place the particle at
+        :return: an array of signed forces, one per particle (zero for the particle itself)
         """
+        if self._stats is not None:
+            self._stats.count('get_forces')
 
-        if p1.position == p2.position:
-            # Don't let particles overlap
-            return 10000
+        seats = self._seats
+        same_group = self._group_ids == self._group_ids[particle]
+        factors = np.where(same_group, self._attraction_factor, self._repulsion_factor)
 
-        if p1.group == p2.group:
-            f = self._attraction_factor * 1.0 / ((self._graph.get_weight(p1.position, p2.position)) ** 2)
-        else:
-            f = self._repulsion_factor * 1.0 / ((self._graph.get_weight(p1.position, p2.position)) ** 2)
-        return f
+        forces = factors * self._inverse_square_distances[position, seats]
+
+        # Don't let particles overlap
+        forces[seats == position] = OVERLAP_FORCE
+
+        # Don't test against the original particle
+        forces[particle] = 0
+        return forces
 
     def _get_energy(self, particle, position=None):
         """
         Get the energy of a particle at a given position
         Energy is defined as the sum of all forces acting on a particle
-        :param particle: the particle to evaluate
-        :param position: [Optional] Provide a new position for the particle
+        :param particle: index of the particle to evaluate
+        :param position: [Optional] Provide a new seat index for the particle
         :return: The energy of the particle at the position
         """
+        if self._stats is not None:
+            self._stats.count('get_energy')
 
         if position is None:
-            position = particle.position
-
-        p_new = Particle(particle.group)
-        p_new.position = position
-
-        energy = 0
+            position = self._seats[particle]
 
         # Get sum of all forces
-        for p_test in self._particles:
-
-            if p_test == particle:
-                # Don't test against the original particle
-                continue
-
-            energy += self._get_force(p_new, p_test)
+        energy = self._get_forces(particle, position).sum()
 
         # Add group orphan penalty
-        energy += self._get_group_orphan_penalty(particle.group, test_particle=particle, test_particle_position=position)
+        group = self._group_ids[particle]
+        energy += self._get_group_orphan_penalty(group, test_particle=particle, test_particle_position=position)
 
         return energy
 
@@ -242,52 +701,179 @@ class Simulation:
         :return: the system's total energy
         """
         system_energy = 0
-        for particle in self._particles:
+        for particle in range(len(self._seats)):
             system_energy += self._get_energy(particle)
 
         return system_energy
 
-    def _get_particles_by_energy(self, particles):
+    def _reset_energy_cache(self):
         """
-        Get a dictionary of particles keyed by their energy
-        :param particles: a set of particles
-        :return: a dictionary
+        Rebuild the incremental energy state from the current seats
+            - group_fields[g, s]: sum of 1/d^2 from seat s to every particle in group g
+            - total_field[s]: sum of 1/d^2 from seat s to every particle
+            - group_penalties[g]: orphan penalty of group g
+            - energies[i]: cached energy of particle i at its seat
+        :return: None
         """
-        particle_energies = dict()
+        occupancy = np.zeros((len(self._group_names), len(self._seat_names)))
+        np.add.at(occupancy, (self._group_ids, self._seats), 1)
 
-        for particle in particles:
-            energy = self._get_energy(particle)
-            particle_energies[energy] = particle
+        self._group_fields = occupancy.dot(self._inverse_square_distances)
+        self._total_field = self._group_fields.sum(axis=0)
+        self._group_penalties = np.array([self._get_group_orphan_penalty(group)
+                                          for group in range(len(self._group_names))], dtype=float)
+        self._update_energy_cache()
+
+    def _update_energy_cache(self):
+        """
+        Recompute the cached energy of every particle from the fields in O(N)
+        :return: None
+        """
+        same_group = self._group_fields[self._group_ids, self._seats]
+        other_groups = self._total_field[self._seats] - same_group
 
-        return particle_energies
+        self._energies = (self._attraction_factor * same_group +
+                          self._repulsion_factor * other_groups +
+                          self._group_penalties[self._group_ids])
 
-    def _get_free_positions(self):
+    def _get_field_forces(self, particle, positions):
+        """
+        Get the sum of the forces on a particle if it were at each of the given seats
+        (the particle's own contribution to the fields is excluded)
+        :param particle: index of the particle
+        :param positions: an array of seat indices
+        :return: an array of force sums, one per position
+        """
+        if self._stats is not None:
+            self._stats.count('get_field_forces')
+
+        group = self._group_ids[particle]
+        seat = self._seats[particle]
+
+        same_group = self._group_fields[group, positions] - self._inverse_square_distances[positions, seat]
+        other_groups = self._total_field[positions] - self._group_fields[group, positions]
+
+        return self._attraction_factor * same_group + self._repulsion_factor * other_groups
+
+    def _get_move_deltas(self, particle, positions):
+        """
+        Get the change in a particle's energy if it were moved to each of the given seats
+        Matches _get_energy(particle, position) - _get_energy(particle) for every position
+        :param particle: index of the particle
+        :param positions: an array of seat indices
+        :return: an array of energy deltas, one per position
+        """
+        if self._stats is not None:
+            self._stats.count('move_evaluations', len(positions))
+
+        seat = self._seats[particle]
+        energies = self._get_field_forces(particle, positions) + self._get_move_penalties(particle, positions)
+
+        # Don't let particles overlap
+        energies[self._occupation_map[positions] & (positions != seat)] += OVERLAP_FORCE
+
+        return energies - self._energies[particle]
+
+    def _move_particle(self, particle, position):
+        """
+        Move a particle to a new seat and update the incremental energy state
+        :param particle: index of the particle
+        :param position: seat index to move the particle to
+        :return: None
+        """
+        if self._stats is not None:
+            self._stats.count('moves')
+
+        group = self._group_ids[particle]
+        old_position = self._seats[particle]
+
+        change = self._inverse_square_distances[position] - self._inverse_square_distances[old_position]
+        self._group_fields[group] += change
+        self._total_field += change
+
+        self._occupation_map[old_position] = False
+        self._occupation_map[position] = True
+        self._seats[particle] = position
+
+        self._group_penalties[group] = self._get_group_orphan_penalty(group)
+        self._update_energy_cache()
+
+    def _get_move_system_delta(self, particle, position):
+        """
+        Get the change in system energy if a particle moved to a free seat
+        Every pair force is counted by both particles and every group penalty by each group member
+        :param particle: index of the particle
+        :param position: index of a free seat
+        :return: the change in _get_system_energy()
+        """
+        group = self._group_ids[particle]
+        positions = np.array([position])
+
+        force = self._energies[particle] - self._group_penalties[group]
+        new_force = self._get_field_forces(particle, positions)[0]
+        new_penalty = self._get_move_penalties(particle, positions)[0]
+
+        group_size = self._group_sizes[group]
+        return 2.0 * (new_force - force) + group_size * (new_penalty - self._group_penalties[group])
+
+    def _get_swap_system_delta(self, particle_a, particle_b):
+        """
+        Get the change in system energy if two particles swapped seats
+        :param particle_a: index of the first particle
+        :param particle_b: index of the second particle
+        :return: the change in _get_system_energy()
+        """
+        group_a = self._group_ids[particle_a]
+        group_b = self._group_ids[particle_b]
+        seat_a = self._seats[particle_a]
+        seat_b = self._seats[particle_b]
+
+        if group_a == group_b:
+            # Forces are unchanged, only the group's orphan penalty can move
+            self._seats[particle_a], self._seats[particle_b] = seat_b, seat_a
+            penalty = self._get_group_orphan_penalty(group_a)
+            self._seats[particle_a], self._seats[particle_b] = seat_a, seat_b
+
+            return self._group_sizes[group_a] * (penalty - self._group_penalties[group_a])
+
+        # The pair's own force is the same after the swap, exclude it from both sides
+        pair_force = self._repulsion_factor * self._inverse_square_distances[seat_a, seat_b]
+
+        force_a = self._energies[particle_a] - self._group_penalties[group_a] - pair_force
+        force_b = self._energies[particle_b] - self._group_penalties[group_b] - pair_force
+        new_force_a = self._get_field_forces(particle_a, np.array([seat_b]))[0]
+        new_force_b = self._get_field_forces(particle_b, np.array([seat_a]))[0]
+
+        new_penalty_a = self._get_move_penalties(particle_a, np.array([seat_b]))[0]
+        new_penalty_b = self._get_move_penalties(particle_b, np.array([seat_a]))[0]
+
+        return (2.0 * (new_force_a - force_a + new_force_b - force_b) +
+                self._group_sizes[group_a] * (new_penalty_a - self._group_penalties[group_a]) +
+                self._group_sizes[group_b] * (new_penalty_b - self._group_penalties[group_b]))
+
+    def _swap_particles(self, particle_a, particle_b):
         """
-        Get a set of free positions in the graph
-        :return: a set of positions
+        Swap the seats of two particles and update the incremental energy state
+        :return: None
         """
-        nodes = self._graph.get_nodes()
-        particles = self._particles.copy()
-        positions = set()
+        seat_a = self._seats[particle_a]
+        seat_b = self._seats[particle_b]
+
+        self._move_particle(particle_a, seat_b)
+        self._move_particle(particle_b, seat_a)
 
-        for node in self._occupation_map:
-            if not self._occupation_map[node]:
-                positions.add(node)
+        # Both seats are still taken
+        self._occupation_map[seat_a] = True
+        self._occupation_map[seat_b] = True
 
-        # for node in nodes:
-        #     particle_found = False
-        #
-        #     for p in particles:
-        #         if node == p.position:
-        #             particles.remove(p)
-        #             particle_found = True
-        #             break
-        #
-        #     if not particle_found:
-        #         positions.add(node)
-        return positions
+    def _get_free_positions(self):
+        """
+        Get the free positions in the graph
+        :return: an array of seat indices
+        """
+        return np.flatnonzero(~self._occupation_map)
 
-    def run_iteration(self, show_result=False):
+    def run_iteration(self, show_result=False, deadline=None):
         """
         Run a single iteration of the simulation
             1. Retrive the particle with the highest energy
@@ -295,93 +881,118 @@ class Simulation:
             3. Update the system to reflect the new position
             4. Repeat for all particles in the system
         :param show_result: [Optional] If true display n image fo the graph after the iteration
-        :return: None
+        :param deadline: [Optional] a time.monotonic() time at which to stop part way through the sweep
+        :return: True if every particle was visited, False if the deadline cut the sweep short
         """
-        import time
+        stats = self._stats
+        if stats is not None:
+            mark = time.perf_counter()
+
+        # Start every sweep from exact fields so float error can't accumulate
+        self._reset_energy_cache()
+
+        todo = EnergyQueue(self._energies)
+        completed = True
 
-        todo = set(self._particles.copy())
+        if stats is not None:
+            mark = stats.lap('iteration.reset_cache', mark)
 
         while len(todo) > 0:
 
+            # Every accepted move lowers the energy, so stopping early keeps the best seats so far
+            if deadline is not None and time.monotonic() >= deadline:
+                completed = False
+                break
+
             # Find the particle with the highest energy
-            particle_energies = self._get_particles_by_energy(todo)
-            keys = sorted(particle_energies)
-            test_particle = particle_energies[keys[0]]
-            todo.remove(test_particle)
+            test_particle = todo.pop()
 
-            # Find the best position to lower the energy of the particle
-            min_energy = self._get_energy(test_particle)
-            best_position = test_particle.position
+            if stats is not None:
+                mark = stats.lap('iteration.select', mark)
+
+            if self._pinned[test_particle]:
+                continue
+
+            # Only moves that lower the energy of the particle are accepted
+            max_delta = 0
+            is_child = self._is_child[test_particle]
 
             # Force children out of the front seats (they can sometimes initialize there)
-            if best_position in self._graph.front_seats and test_particle.is_child:
-                min_energy = 99999
+            if self._front_seats[self._seats[test_particle]] and is_child:
+                max_delta = 99999 - self._energies[test_particle]
 
-            for position in self._get_free_positions():
+            positions = self._get_free_positions()
 
-                # Test if this is a valid seat for a child
-                if position in self._graph.front_seats and test_particle.is_child:
-                    continue
+            # Children can't move into the front seats
+            if is_child:
+                positions = positions[~self._front_seats[positions]]
+
+            if len(positions) == 0:
+                continue
+
+            # Find the best position to lower the energy of the particle
+            deltas = self._get_move_deltas(test_particle, positions)
+            best = np.argmin(deltas)
 
-                energy = self._get_energy(test_particle, position=position)
-                if energy < min_energy:
-                    min_energy = energy
-                    best_position = position
+            if stats is not None:
+                mark = stats.lap('iteration.evaluate', mark)
 
-            # Update the particle's position in the master set
-            for particle in self._particles:
-                if particle == test_particle:
-                    self._occupation_map[particle.position] = False
-                    self._occupation_map[best_position] = True
-                    particle.position = best_position
-                    break
+            if deltas[best] < max_delta:
+                old_energies = self._energies
+                self._move_particle(test_particle, positions[best])
 
-        # Update the graph image and display it (if applicable)
-        self._update_image()
+                # Re-rank the particles whose energy changed
+                for particle in np.flatnonzero(self._energies != old_energies).tolist():
+                    if particle in todo:
+                        todo.update(particle, self._energies[particle])
 
+                if stats is not None:
+                    mark = stats.lap('iteration.move', mark)
+
+        # The seats are only drawn when an image is shown
         if show_result:
-            self._graph.show_graph()
+            self._show_graph()
+        return completed
 
-    def run_sim(self, show_result=False, max_iterations=50, debug=False):
+    def run_sim(self, show_result=False, max_iterations=50, debug=False, deadline=None):
+        """
+        Run iterations until the particles stop moving, max_iterations is reached or the deadline passes
+        :param show_result: [Optional] If true display an image of the graph after each iteration
+        :param max_iterations: the iteration limit (SimSettings.max_iterations)
+        :param debug: [Optional] print progress
+        :param deadline: [Optional] a time.monotonic() time at which to return the best seats found so far
+        :return: the system energy and the particles
+        """
 
         if debug:
             print("===================================")
 
+        if self._stats is not None:
+            start = time.perf_counter()
+
+        self.iterations = 0
         for i in range(max_iterations):
 
             if debug:
                 print("Running iteration: %i" % i)
 
-            old_particles = copy.deepcopy(self._particles)  # Copy of particles to test for convergence
-            self.run_iteration(show_result=False)
+            old_seats = self._seats.copy()  # Snapshot of the seats to test for convergence
+            completed = self.run_iteration(show_result=False, deadline=deadline)
+            self.iterations += 1
 
             if debug:
                 print("\tSystem Energy: %f" % self._get_system_energy())
 
             if show_result:
-                self._graph.show_graph()
+                self._show_graph()
 
-            # Test for convergence
-            new_particles = self._particles
-            converged = True
-            for new_p in new_particles:
-
-                changed_position = True
-
-                # Has the particle stayed in the same position?
-                for old_p in old_particles:
-
-                    if new_p == old_p and new_p.position == old_p.position:
-                        # Yes: Keep testing for convergence
-                        #      No need to keep searching for the particle
-                        old_particles.remove(old_p)
-                        changed_position = False
-                        break
+            if not completed:
+                if debug:
+                    print("Out of time!")
+                break
 
-                # No: Stop testing for convergence (we have not converged)
-                if changed_position:
-                    converged = False
-                    break
+            # Test for convergence (has every particle stayed in the same position?)
+            converged = np.array_equal(old_seats, self._seats)
 
             # If the system has converged (found a local minimum solution) stop the simulation
             if converged:
@@ -389,17 +1000,337 @@ class Simulation:
                     print("Converged!")
                 break
 
+        # Update the master list positions once the seats have settled
+        self._sync_particles()
+
+        if self._stats is not None:
+            self._stats.count('iterations', self.iterations)
+            self._stats.lap('run_sim', start)
+
         if debug:
             print("Simulation Complete")
         return self._get_system_energy(), self._particles
 
+    def _propose_move(self, movable, seat_particles):
+        """
+        Pick a random move (or swap) for run_annealing
+        :param movable: the indices of the unpinned particles
+        :param seat_particles: the particle in every seat, -1 for free seats
+        :return: the particle, its new seat, the particle in that seat (-1 if free) and the system energy
+                 change, or None if the move isn't allowed or changes nothing
+        """
+        particle = movable[self._random.randrange(len(movable))]
+        seat = self._seats[particle]
+        position = self._random.randrange(len(self._seat_names))
+        other = seat_particles[position]
+
+        if position == seat:
+            return None
+
+        if other >= 0 and self._pinned[other]:
+            return None
+
+        # Children can't move into the front seats
+        if self._is_child[particle] and self._front_seats[position]:
+            return None
+        if other >= 0 and self._is_child[other] and self._front_seats[seat]:
+            return None
+
+        if other < 0:
+            return particle, position, other, self._get_move_system_delta(particle, position)
+
+        if self._group_ids[other] == self._group_ids[particle] and self._is_child[other] == self._is_child[particle]:
+            # Swapping identical passengers changes nothing
+            return None
+        return particle, position, other, self._get_swap_system_delta(particle, other)
+
+    def _get_typical_uphill_delta(self, movable, seat_particles, samples=200):
+        """
+        Estimate the energy cost of a typical uphill move from the current seats
+        :param movable: the indices of the unpinned particles
+        :param seat_particles: the particle in every seat, -1 for free seats
+        :param samples: the number of random moves to try
+        :return: the median energy increase of the sampled uphill moves, or 0 if none were found
+        """
+        deltas = list()
+        for _ in range(samples):
+            move = self._propose_move(movable, seat_particles)
+            if move is not None and move[3] > 0:
+                deltas.append(move[3])
+
+        if len(deltas) == 0:
+            return 0.0
+        return float(np.median(deltas))
+
+    def run_annealing(self, show_result=False, max_iterations=50, debug=False, deadline=None,
+                      start_acceptance=0.5, end_acceptance=0.001):
+        """
+        Optimize the current seats with simulated annealing, then polish the result with run_sim
+            1. Pick a random particle and a random seat
+            2. Move the particle there (free seat) or swap it with the seat's particle (taken seat)
+            3. Accept the change if it lowers the system energy, or with probability exp(-delta / T)
+            4. Cool T geometrically from the start to the end temperature
+        The temperatures are scaled to the trip's forces: a typical uphill move (the median of a sample of
+        random moves) is accepted with probability start_acceptance at first and end_acceptance at the end
+        :param show_result: [Optional] If true display an image of the graph after the simulation
+        :param max_iterations: number of sweeps (one sweep is one move per particle)
+        :param debug: [Optional] print progress
+        :param deadline: [Optional] a time.monotonic() time at which to stop cooling and keep the best seats
+        :param start_acceptance: the initial probability of accepting a typical uphill move
+        :param end_acceptance: the final probability of accepting a typical uphill move
+        :return: the system energy and the particles
+        """
+        particles = len(self._seats)
+        movable = np.flatnonzero(~self._pinned)
+        steps = max_iterations * len(movable)
+        self.annealing_sweeps = 0.0
+
+        if len(movable) == 0 or steps == 0:
+            return self.run_sim(show_result=show_result, max_iterations=max_iterations, debug=debug,
+                                deadline=deadline)
+
+        self._reset_energy_cache()
+        seat_particles = np.full(len(self._seat_names), -1, dtype=int)
+        seat_particles[self._seats] = np.arange(particles)
+
+        uphill_delta = self._get_typical_uphill_delta(movable, seat_particles)
+        if uphill_delta <= 0:
+            # No move costs anything, there is nothing to anneal
+            return self.run_sim(show_result=show_result, max_iterations=max_iterations, debug=debug,
+                                deadline=deadline)
+
+        start_temperature = uphill_delta / -np.log(start_acceptance)
+        end_temperature = uphill_delta / -np.log(end_acceptance)
+
+        energy = self._energies.sum()
+        best_energy = energy
+        best_seats = self._seats.copy()
+
+        cooling = (end_temperature / start_temperature) ** (1.0 / steps)
+        temperature = start_temperature
+        steps_done = steps
+
+        for step in range(steps):
+            temperature *= cooling
+
+            # Checking the clock every step would cost more than the step itself
+            if deadline is not None and step % 64 == 0 and time.monotonic() >= deadline:
+                steps_done = step
+                break
+
+            move = self._propose_move(movable, seat_particles)
+            if move is None:
+                continue
+
+            particle, position, other, delta = move
+            if delta > 0 and self._random.random() >= np.exp(-delta / temperature):
+                continue
+
+            seat = self._seats[particle]
+            if other < 0:
+                self._move_particle(particle, position)
+                seat_particles[seat] = -1
+            else:
+                self._swap_particles(particle, other)
+                seat_particles[seat] = other
+            seat_particles[position] = particle
+
+            energy += delta
+            if energy < best_energy:
+                best_energy = energy
+                best_seats = self._seats.copy()
+
+        self.annealing_sweeps = steps_done / float(len(movable))
+        if self._stats is not None:
+            self._stats.count('annealing_steps', steps_done)
+
+        if debug:
+            print("Annealing best energy: %f" % best_energy)
+
+        self._seats[:] = best_seats
+        self._occupation_map[:] = False
+        self._occupation_map[self._seats] = True
 
+        # Settle into the nearest local minimum (with whatever time is left)
+        return self.run_sim(show_result=show_result, max_iterations=max_iterations, debug=debug, deadline=deadline)
 
+    def run_exact(self, show_result=False, max_iterations=50, debug=False, deadline=None, max_nodes=50000):
+        """
+        Find the minimum energy seating with a depth first branch and bound search
+            1. Start from an annealed layout (the first upper bound, if it keeps the children out of the front seats)
+            2. Place passengers group by group (largest first, adults before children)
+            3. Prune a branch when an admissible lower bound on its energy can't beat the best layout
+        The search gives up after max_nodes nodes (or at the deadline) and keeps the best layout found,
+        so it is only practical for small boats. The result is only proven optimal if the search finished and
+        the bound holds for the forces (attractive_force <= 0 <= repulsive_force and orphan_penalty >= 0).
+        :param show_result: [Optional] If true display an image of the graph after the simulation
+        :param max_iterations: sweeps of the annealing run used as the first upper bound
+        :param debug: [Optional] print progress
+        :param deadline: [Optional] a time.monotonic() time at which to stop searching
+        :param max_nodes: the search budget
+        :return: the system energy, the particles and True if the result is proven optimal
+        """
+        self.init_particles()
+        self.run_annealing(max_iterations=max_iterations, deadline=deadline)
+        best_seats = self._seats.copy()
+
+        # A child in a front seat costs nothing, so such a layout would prune every valid one
+        if np.any(self._front_seats[self._seats[self._is_child]]):
+            best_energy = np.inf
+        else:
+            best_energy = self._get_system_energy()
+
+        # The pair term of lower_bound assumes attraction lowers and repulsion raises the energy
+        admissible = self._attraction_factor <= 0 <= self._repulsion_factor and self._orphan_penalty >= 0
+
+        particles = len(self._seats)
+        seats = len(self._seat_names)
+        groups = len(self._group_names)
+        inverse_square = self._inverse_square_distances
+
+        # Placement order: largest groups first, adults before children
+        order = list()
+        for group in sorted(range(groups), key=lambda g: (-self._group_sizes[g], g)):
+            group_adults, group_children = self._groups[group]
+            order.extend(group_adults.tolist())
+            order.extend(group_children.tolist())
+
+        order_groups = self._group_ids[order]
+        order_children = self._is_child[order]
+
+        # For each depth k: the (group, is_child, count) classes of order[k:] and their pair counts
+        remaining_classes = list()
+        same_pairs = list()
+        other_pairs = list()
+        for k in range(particles + 1):
+            classes = dict()
+            for j in range(k, particles):
+                key = (order_groups[j], order_children[j])
+                classes[key] = classes.get(key, 0) + 1
+            remaining_classes.append([(group, is_child, count) for (group, is_child), count in classes.items()])
+
+            remaining = np.bincount(order_groups[k:], minlength=groups)
+            same_pairs.append(int((remaining * (remaining - 1) // 2).sum()))
+            other_pairs.append((particles - k) * (particles - k - 1) // 2 - same_pairs[k])
+
+        group_fields = np.zeros((groups, seats))
+        total_field = np.zeros(seats)
+        free = np.ones(seats, dtype=bool)
+        placed_seats = np.full(particles, -1, dtype=int)
+        nodes = 0
+        out_of_time = False
+        out_of_nodes = False
+
+        def orphan_costs(group, positions):
+            # Cost of seating one child of the group at each position (every adult is placed)
+            group_adults = self._groups[group][0]
+            adult_seats = np.tile(placed_seats[group_adults], (len(positions), 1))
+            return self._group_sizes[group] * self._get_orphan_penalties(positions[:, np.newaxis], adult_seats)
+
+        def lower_bound(k):
+            # Admissible bound on the cost of placing order[k + 1:] once order[k] is placed
+            # (later passengers may only use seats that are free now, and their forces with
+            # order[k] are covered by the pair term over order[k:])
+            seat_costs = 2.0 * (self._attraction_factor * group_fields +
+                                self._repulsion_factor * (total_field - group_fields))
+            child_seats = free & ~self._front_seats
+
+            bound = 0.0
+            for group, is_child, count in remaining_classes[k + 1]:
+                positions = np.flatnonzero(child_seats if is_child else free)
+                if len(positions) < count:
+                    return np.inf
+
+                costs = seat_costs[group, positions]
+                if is_child and np.all(placed_seats[self._groups[group][0]] >= 0):
+                    costs = costs + orphan_costs(group, positions)
+
+                # The class needs count different seats
+                bound += np.partition(costs, count - 1)[:count].sum()
+
+            pair_values = np.sort(inverse_square[np.ix_(free, free)][np.triu_indices(free.sum(), 1)])
+            if same_pairs[k] > 0:
+                bound += 2.0 * self._attraction_factor * pair_values[len(pair_values) - same_pairs[k]:].sum()
+            if other_pairs[k] > 0:
+                bound += 2.0 * self._repulsion_factor * pair_values[:other_pairs[k]].sum()
+            return bound
+
+        def search(k, energy):
+            nonlocal best_energy, nodes, out_of_time, out_of_nodes
+
+            if out_of_time or out_of_nodes:
+                return
+            if nodes >= max_nodes:
+                out_of_nodes = True
+                return
+            nodes += 1
+
+            if deadline is not None and nodes % 256 == 0 and time.monotonic() >= deadline:
+                out_of_time = True
+                return
+
+            if k == particles:
+                if energy < best_energy:
+                    best_energy = energy
+                    best_seats[:] = placed_seats
+                return
+
+            particle = order[k]
+            group = order_groups[k]
+
+            allowed = free.copy()
+            if order_children[k]:
+                allowed &= ~self._front_seats
+
+            # Passengers of the same class are interchangeable, seat them in increasing seat order
+            if k > 0 and order_groups[k - 1] == group and order_children[k - 1] == order_children[k]:
+                allowed[:placed_seats[order[k - 1]] + 1] = False
+
+            positions = np.flatnonzero(allowed)
+            if len(positions) == 0:
+                return
+
+            # Exact cost of seating the passenger at each position
+            costs = 2.0 * (self._attraction_factor * group_fields[group, positions] +
+                           self._repulsion_factor * (total_field[positions] - group_fields[group, positions]))
+            if order_children[k]:
+                costs += orphan_costs(group, positions)
+
+            bounds = energy + costs + lower_bound(k)
+
+            for candidate in np.argsort(costs):
+                if bounds[candidate] >= best_energy - 1e-9:
+                    continue
+
+                position = positions[candidate]
+                placed_seats[particle] = position
+                free[position] = False
+                group_fields[group] += inverse_square[position]
+                total_field[:] += inverse_square[position]
 
+                search(k + 1, energy + costs[candidate])
 
+                total_field[:] -= inverse_square[position]
+                group_fields[group] -= inverse_square[position]
+                free[position] = True
+                placed_seats[particle] = -1
 
+        search(0, 0.0)
+        optimal = admissible and not out_of_nodes and not out_of_time and best_energy < np.inf
 
+        if debug:
+            print("Branch and bound: %d nodes, optimal: %s" % (nodes, optimal))
 
+        self.set_seats(best_seats)
 
+        if show_result:
+            self._show_graph()
+        return self._get_system_energy(), self._particles, optimal
 
+# Optimizer engines selectable through SimSettings.optimizer
+OPTIMIZERS = {'particle': Simulation.run_sim,
+              'annealing': Simulation.run_annealing}
 
+# Starting layouts selectable through SimSettings.initializer
+INITIALIZERS = {'random': Simulation.init_particles,
+                'buckets': Simulation.init_buckets}
@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+def _hash(data):
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def get_trip_key(passengers):
+    """
+    Hash the groups of a trip (confirmation number, adults and children of every group)
+    :param passengers: the trip's Particles
+    :return: a hex digest
+    """
+    groups = dict()
+    for passenger in passengers:
+        adults, children = groups.get(passenger.group, (0, 0))
+        if passenger.is_child:
+            children += 1
+        else:
+            adults += 1
+        groups[passenger.group] = (adults, children)
+
+    return _hash(sorted([group, adults, children] for group, (adults, children) in groups.items()))
+
+
+def get_layout_key(boat_graph):
+    """
+    Hash the seats of a boat (names, positions and front seats)
+    :param boat_graph: the boat's graph
+    :return: a hex digest
+    """
+    seats = list()
+    for node in boat_graph.get_node_names():
+        seats.append([node, list(boat_graph.get_position(node)), node in boat_graph.front_seats])
+    return _hash(seats)
+
+
+def get_settings_key(sim_settings):
+    """
+    Hash the simulation settings that change the result
+    :param sim_settings: the SimSettings
+    :return: a hex digest
+    """
+    data = sim_settings.get_data()
+
+    # The number of worker processes and the instrumentation don't change the result
+    del data['workers']
+    del data['collect_stats']
+    return _hash(data)
+
+
+def get_seat_map(passengers, seat_names, seats):
+    """
+    Get the seats of every group by name (so they survive passenger order changes)
+    :param passengers: the trip's Particles
+    :param seat_names: the seat names, ordered by seat index
+    :param seats: the seat index of every passenger
+    :return: a dictionary of confirmation number -> {'adults': [seat names], 'children': [seat names]}
+    """
+    seat_map = dict()
+    for passenger, seat in zip(passengers, seats):
+        group_seats = seat_map.setdefault(passenger.group, {'adults': list(), 'children': list()})
+        group_seats['children' if passenger.is_child else 'adults'].append(seat_names[seat])
+    return seat_map
+
+
+def apply_seat_map(passengers, seat_names, seat_map):
+    """
+    Look up the seat of every passenger in a seat map
+    :param passengers: the trip's Particles
+    :param seat_names: the seat names, ordered by seat index
+    :param seat_map: a seat map from get_seat_map
+    :return: an array of seat indices, -1 for passengers the seat map has no seat for
+    """
+    seat_indices = {name: i for i, name in enumerate(seat_names)}
+    free = dict()
+    for group, group_seats in seat_map.items():
+        for kind in ('adults', 'children'):
+            free[(group, kind)] = [seat_indices[name] for name in group_seats[kind] if name in seat_indices]
+
+    seats = np.full(len(passengers), -1, dtype=int)
+    for i, passenger in enumerate(passengers):
+        group_seats = free.get((passenger.group, 'children' if passenger.is_child else 'adults'))
+        if group_seats:
+            seats[i] = group_seats.pop()
+    return seats
+
+
+class ResultsCache:
+    """
+    On-disk cache of the best seating chart of a trip
+    Entries are keyed by the trip's groups, the boat layout and the simulation settings, with one
+    subdirectory per boat layout and settings so warm starts only read the entries that can be used
+    """
+
+    def __init__(self, directory='cache', max_entries=200):
+        """
+        :param directory: the cache directory
+        :param max_entries: the number of trips kept per boat layout and settings, the least recently
+                            used entries are removed
+        """
+        self._directory = directory
+        self._max_entries = max_entries
+
+    def _get_file_name(self, key, context):
+        return os.path.join(self._directory, context, key + ".json")
+
+    def _read(self, file_name):
+        try:
+            with open(file_name, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            # Missing or corrupt entry
+            return None
+
+    def get_keys(self, passengers, boat_graph, sim_settings):
+        """
+        :return: the trip key and the context key (boat layout and settings)
+        """
+        return get_trip_key(passengers), _hash([get_layout_key(boat_graph), get_settings_key(sim_settings)])
+
+    def lookup(self, passengers, boat_graph, sim_settings):
+        """
+        Find the cached result of exactly this trip, boat and settings
+        :return: the energy and the seat index of every passenger, or None
+        """
+        key, context = self.get_keys(passengers, boat_graph, sim_settings)
+        entry = self._read(self._get_file_name(key, context))
+        if entry is None:
+            return None
+
+        seats = apply_seat_map(passengers, boat_graph.get_node_names(), entry['groups'])
+        if np.any(seats < 0):
+            return None
+
+        # Mark the entry as recently used so it isn't evicted
+        os.utime(self._get_file_name(key, context))
+        return entry['energy'], seats
+
+    def find_warm_start(self, passengers, boat_graph, sim_settings):
+        """
+        Find the cached result for the same boat and settings that seats the most of these passengers
+        (e.g. an earlier version of the manifest)
+        :return: the seat index of every passenger (-1 for passengers it has no seat for), or None
+        """
+        _, context = self.get_keys(passengers, boat_graph, sim_settings)
+        directory = os.path.join(self._directory, context)
+        if not os.path.isdir(directory):
+            return None
+
+        seat_names = boat_graph.get_node_names()
+        best_seats = None
+        best_rank = None
+
+        for file_name in os.listdir(directory):
+            file_name = os.path.join(directory, file_name)
+            entry = self._read(file_name)
+            if entry is None:
+                continue
+
+            seats = apply_seat_map(passengers, seat_names, entry['groups'])
+
+            # Most seated passengers first, then the most recent entry
+            rank = (int(np.count_nonzero(seats >= 0)), os.path.getmtime(file_name))
+            if rank[0] > 0 and (best_rank is None or rank > best_rank):
+                best_seats = seats
+                best_rank = rank
+
+        return best_seats
+
+    def store(self, passengers, boat_graph, sim_settings, energy, seats):
+        """
+        Save the best result of a trip
+        :param passengers: the trip's Particles
+        :param boat_graph: the boat's graph
+        :param sim_settings: the SimSettings used
+        :param energy: the system energy of the result
+        :param seats: the seat index of every passenger
+        :return: None
+        """
+        key, context = self.get_keys(passengers, boat_graph, sim_settings)
+        file_name = self._get_file_name(key, context)
+
+        # Keep the better result if the trip has been seated before
+        entry = self._read(file_name)
+        if entry is not None and entry['energy'] <= energy:
+            os.utime(file_name)
+            return
+
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        with open(file_name, 'w') as file:
+            json.dump({'energy': float(energy),
+                       'groups': get_seat_map(passengers, boat_graph.get_node_names(), seats)}, file)
+
+        self._evict(os.path.dirname(file_name))
+
+    def _evict(self, directory):
+        """
+        Remove the least recently used entries beyond max_entries
+        :param directory: a context subdirectory
+        :return: None
+        """
+        file_names = [os.path.join(directory, file_name) for file_name in os.listdir(directory)]
+        if len(file_names) <= self._max_entries:
+            return
+
+        file_names.sort(key=os.path.getmtime)
+        for file_name in file_names[:len(file_names) - self._max_entries]:
+            try:
+                os.remove(file_name)
+            except OSError:
+                # Removed by another process
+                pass
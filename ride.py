@@ -1,4 +1,5 @@
 import csv
+from collections import namedtuple
 
 import particle_simulation as ps
 
@@ -8,7 +9,7 @@ class Group:
         self.first_name = first_name
         self.last_name = last_name
         self.confirmation_number= confirmation_number
-        self.passengers = set()
+        self.passengers = list()
         self.adults = 0
         self.children = 0
 
@@ -17,7 +18,7 @@ class Group:
 
     def add_passenger(self, position=None, is_child=False):
         new_passenger = ps.Particle(self.confirmation_number, is_child=is_child, position=position)
-        self.passengers.add(new_passenger)
+        self.passengers.append(new_passenger)
 
         if is_child:
             self.children += 1
@@ -25,66 +26,204 @@ class Group:
             self.adults += 1
 
 
-class Trip:
-    def __init__(self, manifest_file):
-        self.ride_date = ""
-        self.groups = set()
-        self._load_manifest_file(manifest_file)
+# A booking row of a manifest
+GroupRecord = namedtuple('GroupRecord', ['line', 'ride_date', 'first_name', 'last_name', 'group_name',
+                                         'confirmation_number', 'adults', 'children', 'comps', 'total'])
+
+# A manifest row that could not be read
+RowError = namedtuple('RowError', ['line', 'message'])
+
+# Manifest column -> (GroupRecord field, type, required)
+MANIFEST_COLUMNS = {'Event Date': ('ride_date', str, True),
+                    'First Name': ('first_name', str, True),
+                    'Last Name': ('last_name', str, True),
+                    'Group Name': ('group_name', str, False),
+                    'Confirmation Number': ('confirmation_number', str, True),
+                    'Adults': ('adults', int, True),
+                    'Children': ('children', int, True),
+                    'Comps': ('comps', int, False),
+                    'Total Guests': ('total', int, False)}
+
+
+def _parse_row(row, columns, line):
+    values = {'line': line}
+
+    for field, _, _ in MANIFEST_COLUMNS.values():
+        values[field] = None
 
-    def _load_manifest_file(self, manifest_file):
+    for name, index in columns.items():
+        field, field_type, required = MANIFEST_COLUMNS[name]
+        value = row[index].strip() if index < len(row) else ""
 
-        with open(manifest_file) as csvfile:
-            read_csv = csv.reader(csvfile)
+        if value == "":
+            if required:
+                raise ValueError("%s is missing" % name)
+            continue
 
-            found_data_start = False
-            for row in read_csv:
+        try:
+            values[field] = field_type(value)
+        except ValueError:
+            raise ValueError("%s is not a number: %r" % (name, value))
 
-                if not found_data_start and len(row) > 1:
+    if values['adults'] < 0 or values['children'] < 0:
+        raise ValueError("Adults and Children can't be negative")
+
+    return GroupRecord(**values)
+
+
+def read_manifest(manifest_file, errors=None):
+    """
+    Read the bookings of a manifest csv file one row at a time
+    Columns are found by name in the header row (the first row with more than one cell)
+    :param manifest_file: the manifest file name
+    :param errors: [Optional] a list that RowErrors are appended to (bad rows are skipped)
+    :return: a generator of GroupRecords
+    """
+    if errors is None:
+        errors = list()
+
+    with open(manifest_file, newline='') as csvfile:
+        read_csv = csv.reader(csvfile)
+
+        columns = None
+        for row in read_csv:
+            line = read_csv.line_num
+
+            if columns is None:
+                if len(row) > 1:
                     # Found the table header -- data begins after this
-                    found_data_start = True
-                    continue
+                    header = [cell.strip() for cell in row]
+                    columns = {name: header.index(name) for name in MANIFEST_COLUMNS if name in header}
+
+                    missing = [name for name, (_, _, required) in MANIFEST_COLUMNS.items()
+                               if required and name not in columns]
+                    if len(missing) > 0:
+                        errors.append(RowError(line, "Missing columns: %s" % ", ".join(missing)))
+                        return
+                continue
+
+            # Blank rows (e.g. added by excel)
+            if all(cell.strip() == "" for cell in row):
+                continue
+
+            try:
+                yield _parse_row(row, columns, line)
+            except ValueError as e:
+                errors.append(RowError(line, str(e)))
+
+        if columns is None:
+            errors.append(RowError(0, "No header row found"))
+
+
+def load_trips(manifest_file, errors=None):
+    """
+    Split a manifest into one Trip per departure (e.g. a multi-day booking export) in a single pass
+    :param manifest_file: the manifest file name
+    :param errors: [Optional] a list that RowErrors are appended to
+    :return: a dictionary of departure -> Trip, in the order the departures first appear
+    """
+    trips = dict()
+    for record in read_manifest(manifest_file, errors):
+        if record.ride_date not in trips:
+            trips[record.ride_date] = Trip()
+        trips[record.ride_date].add_group(record)
+    return trips
 
-                if found_data_start:
 
-                    try:
-                        ride_date = row[0]
-                        first_name = row[1]
-                        last_name = row[2]
-                        group_name = row[3]
-                        confirm_num = row[4]
-                        adults = int(row[5])
-                        children = int(row[6])
-                        comps = int(row[7])
-                        total = int(row[8])
-                        payment = row[9]
-                        reservation_date = row[10]
-                        private_notes = row[11]
-                        comments = row[12]
-                        referal = row[13]
-                        add_ons = row[14]
+class Trip:
+    def __init__(self, manifest_file=None, records=None):
+        """
+        :param manifest_file: [Optional] the manifest csv file to load
+        :param records: [Optional] GroupRecords to load instead of a file
+        """
+        self.ride_date = ""
+        self.groups = set()
+        self.errors = list()
+        self._passengers = list()
 
-                        self.ride_date=ride_date
+        if manifest_file is not None:
+            records = read_manifest(manifest_file, self.errors)
 
-                        new_group = Group(first_name, last_name, confirm_num)
+        if records is not None:
+            for record in records:
+                self.add_group(record)
 
-                        for adult in range(adults):
-                            new_group.add_passenger(is_child=False)
+    def add_group(self, record):
+        """
+        Add a booking to the trip
+        :param record: a GroupRecord
+        :return: the new Group
+        """
+        self.ride_date = record.ride_date
 
-                        for child in range(children):
-                            new_group.add_passenger(is_child=True)
+        new_group = Group(record.first_name, record.last_name, record.confirmation_number)
 
-                        self.groups.add(new_group)
+        for adult in range(record.adults):
+            new_group.add_passenger(is_child=False)
 
-                    except:
-                        # Extra row added by excel
-                        pass
+        for child in range(record.children):
+            new_group.add_passenger(is_child=True)
+
+        self.groups.add(new_group)
+        self._passengers.extend(new_group.passengers)
+        return new_group
 
     def get_passengers(self):
+        return list(self._passengers)
+
+    def diff(self, previous_trip):
+        """
+        Compare the groups with an earlier version of the trip (groups are matched by confirmation number)
+        :param previous_trip: the earlier Trip
+        :return: lists of the unchanged, changed and added groups of this trip and the groups that were removed
+        """
+        previous_groups = dict()
+        for group in previous_trip.groups:
+            previous_groups[group.confirmation_number] = group
+
+        unchanged = list()
+        changed = list()
+        added = list()
 
-        result = set()
         for group in self.groups:
-            result = set.union(result, group.passengers)
-        return result
+            previous = previous_groups.pop(group.confirmation_number, None)
+
+            if previous is None:
+                added.append(group)
+            elif previous.adults == group.adults and previous.children == group.children:
+                unchanged.append(group)
+            else:
+                changed.append(group)
+
+        return unchanged, changed, added, list(previous_groups.values())
+
+    def keep_seats(self, previous_trip):
+        """
+        Copy the seats of the groups that haven't changed since an earlier (seated) version of the trip
+        :param previous_trip: the earlier Trip
+        :return: the groups that kept their seats
+        """
+        previous_groups = dict()
+        for group in previous_trip.groups:
+            previous_groups[group.confirmation_number] = group
+
+        kept = list()
+        for group in self.diff(previous_trip)[0]:
+            previous = previous_groups[group.confirmation_number]
+
+            seats = dict()
+            for passenger in previous.passengers:
+                seats.setdefault(passenger.is_child, list()).append(passenger.position)
+
+            if None in seats.get(False, list()) + seats.get(True, list()):
+                # The earlier trip was never seated
+                continue
+
+            for passenger in group.passengers:
+                passenger.position = seats[passenger.is_child].pop()
+            kept.append(group)
+
+        return kept
 
     def print(self):
         print(self.to_string())
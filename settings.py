@@ -8,11 +8,13 @@ class BoatSettings:
         self.id = data['id']
         self.name = data['name']
         self.image_file = data['image_file']
+        self.layout_file = data['layout_file']
 
     def get_data(self):
         return {'id': self.id,
                 'name': self.name,
-                'image_file': self.image_file}
+                'image_file': self.image_file,
+                'layout_file': self.layout_file}
 
 
 class SimSettings:
@@ -23,13 +25,48 @@ class SimSettings:
         self.attractive_force = data['attractive_force']
         self.repulsive_force = data['repulsive_force']
         self.orphan_penalty = data['orphan_penalty']
+        self.workers = data.get('workers', 0)
+        self.optimizer = data.get('optimizer', 'particle')
+        self.annealing_start_acceptance = data.get('annealing_start_acceptance', 0.5)
+        self.annealing_end_acceptance = data.get('annealing_end_acceptance', 0.001)
+        self.exact_max_seats = data.get('exact_max_seats', 20)
+        self.exact_max_nodes = data.get('exact_max_nodes', 20000)
+        self.plateau_trials = data.get('plateau_trials', 80)
+        self.time_budget = data.get('time_budget', 0)
+        self.trial_time_limit = data.get('trial_time_limit', 0)
+        self.initializer = data.get('initializer', 'buckets')
+        self.collect_stats = data.get('collect_stats', False)
+        self.seed = data.get('seed', None)
 
     def get_data(self):
         return {'max_iterations': self.max_iterations,
                 'trials': self.trials,
                 'attractive_force': self.attractive_force,
                 'repulsive_force': self.repulsive_force,
-                'orphan_penalty': self.orphan_penalty}
+                'orphan_penalty': self.orphan_penalty,
+                'workers': self.workers,
+                'optimizer': self.optimizer,
+                'annealing_start_acceptance': self.annealing_start_acceptance,
+                'annealing_end_acceptance': self.annealing_end_acceptance,
+                'exact_max_seats': self.exact_max_seats,
+                'exact_max_nodes': self.exact_max_nodes,
+                'plateau_trials': self.plateau_trials,
+                'time_budget': self.time_budget,
+                'trial_time_limit': self.trial_time_limit,
+                'initializer': self.initializer,
+                'collect_stats': self.collect_stats,
+                'seed': self.seed}
+
+    def get_optimizer_options(self, optimizer=None):
+        """
+        Get the extra keyword arguments of an optimizer engine (see particle_simulation.OPTIMIZERS)
+        :param optimizer: [Optional] the optimizer's name, the configured optimizer by default
+        :return: a dictionary
+        """
+        if (optimizer or self.optimizer) == 'annealing':
+            return {'start_acceptance': self.annealing_start_acceptance,
+                    'end_acceptance': self.annealing_end_acceptance}
+        return dict()
 
 
 class Settings:
@@ -0,0 +1,419 @@
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import particle_simulation as ps
+import layout
+
+
+# Boat graphs built inside this (worker) process, keyed by (layout file, image file)
+_graphs = dict()
+
+
+def get_worker_count(workers=0):
+    """
+    Get the number of worker processes to start
+    :param workers: the requested worker count (0 or less uses every available core)
+    :return: the number of workers
+    """
+    if workers is None or workers <= 0:
+        return os.cpu_count() or 1
+    return workers
+
+
+def _get_graph(layout_file, image_file):
+    key = (layout_file, image_file)
+
+    if key not in _graphs:
+        _graphs[key] = layout.get_layout(layout_file).create_graph(image_file)
+    return _graphs[key]
+
+
+def get_master_seed(seed=None):
+    """
+    Get the seed that a run's trial seeds are derived from
+    :param seed: the configured seed, or None for a new seed every run
+    :return: an integer seed
+    """
+    if seed is None:
+        return random.SystemRandom().randrange(2 ** 32)
+    return seed
+
+
+def run_trial(sim, seed, trial, optimizer, max_iterations, time_limit=0, initializer='random', start_seats=None,
+              optimizer_options=None):
+    """
+    Run a single trial of a seeded run, e.g. to run the winning trial again
+    :param sim: the trip's Simulation
+    :param seed: the run's master seed
+    :param trial: the trial's index in the run
+    :param optimizer: the name of the optimizer engine (see particle_simulation.OPTIMIZERS)
+    :param max_iterations: the iteration limit of the trial
+    :param time_limit: seconds the trial may run before it returns its best seats so far (0 for no limit)
+    :param initializer: the name of the starting layout (see particle_simulation.INITIALIZERS)
+    :param start_seats: [Optional] seat indices to start from instead (e.g. a cached layout), -1 for
+                        passengers to place randomly
+    :param optimizer_options: [Optional] extra keyword arguments of the optimizer (see
+                              SimSettings.get_optimizer_options)
+    :return: the trial's energy (the simulation is left at the trial's seats)
+    """
+    start = time.perf_counter()
+    sim.seed(ps.get_trial_seed(seed, trial))
+    if start_seats is None:
+        ps.INITIALIZERS[initializer](sim)
+    else:
+        sim.init_particles(seats=start_seats)
+
+    stats = sim.get_stats()
+    if stats is not None:
+        stats.lap('init', start)
+
+    deadline = time.monotonic() + time_limit if time_limit > 0 else None
+
+    energy, _ = ps.OPTIMIZERS[optimizer](sim, show_result=False, max_iterations=max_iterations, debug=False,
+                                         deadline=deadline, **(optimizer_options or dict()))
+
+    if stats is not None:
+        stats.add_trial(sim.iterations, energy, time.perf_counter() - start)
+    return energy
+
+
+def _create_simulation(layout_file, image_file, state, forces, collect_stats):
+    node_graph = _get_graph(layout_file, image_file)
+    repulsive_force, attractive_force, orphan_penalty = forces
+    sim = ps.Simulation(node_graph, state, repulsive_force, attractive_force, orphan_penalty)
+
+    if collect_stats:
+        sim.set_stats(ps.SimulationStats())
+    return sim
+
+
+def _get_batch_result(sim, results):
+    if sim.get_stats() is not None:
+        return results, sim.get_stats().get_data()
+    return results, None
+
+
+def run_exact_trial(layout_file, image_file, state, forces, max_iterations, max_nodes, collect_stats=False,
+                    seed=0, trial=0):
+    """
+    Try to prove the optimal seating with the branch and bound search (executed inside a worker process)
+    :param layout_file: the boat's layout file
+    :param image_file: the boat's image file
+    :param state: the trip's PassengerState
+    :param forces: a (repulsive, attractive, orphan penalty) tuple
+    :param max_iterations: sweeps of the annealing run that gives the search its first bound
+    :param max_nodes: the search budget (see Simulation.run_exact)
+    :param collect_stats: instrument the simulation (see particle_simulation.SimulationStats)
+    :param seed: the run's master seed
+    :param trial: the search's trial index in the run
+    :return: a list with the (energy, seats) tuple of the optimal seating (empty if the search gave up before
+             proving it) and the stats data (None if not collected)
+    """
+    sim = _create_simulation(layout_file, image_file, state, forces, collect_stats)
+    sim.seed(ps.get_trial_seed(seed, trial))
+
+    energy, _, optimal = sim.run_exact(show_result=False, max_iterations=max_iterations, debug=False,
+                                       max_nodes=max_nodes)
+    if not optimal:
+        return _get_batch_result(sim, list())
+    return _get_batch_result(sim, [(energy, sim.get_seats())])
+
+
+def run_trials(layout_file, image_file, state, forces, optimizer, max_iterations, trials, time_limit=0,
+               initializer='random', collect_stats=False, seed=0, first_trial=0, start_seats=None,
+               optimizer_options=None):
+    """
+    Run a batch of independent trials (executed inside a worker process)
+    :param layout_file: the boat's layout file
+    :param image_file: the boat's image file
+    :param state: the trip's PassengerState
+    :param forces: a (repulsive, attractive, orphan penalty) tuple
+    :param optimizer: the name of the optimizer engine (see particle_simulation.OPTIMIZERS)
+    :param max_iterations: the iteration limit of a single trial
+    :param trials: the number of trials to run
+    :param time_limit: seconds a single trial may run before it returns its best seats so far (0 for no limit)
+    :param initializer: the name of the starting layout (see particle_simulation.INITIALIZERS)
+    :param collect_stats: instrument the simulation (see particle_simulation.SimulationStats)
+    :param seed: the run's master seed (see run_trial)
+    :param first_trial: the index of the batch's first trial in the run
+    :param start_seats: [Optional] seat indices every trial starts from (see run_trial)
+    :param optimizer_options: [Optional] extra keyword arguments of the optimizer (see run_trial)
+    :return: a list of (energy, seats) tuples, one per trial, and the stats data (None if not collected)
+    """
+    sim = _create_simulation(layout_file, image_file, state, forces, collect_stats)
+
+    results = list()
+    for trial in range(first_trial, first_trial + trials):
+        energy = run_trial(sim, seed, trial, optimizer, max_iterations, time_limit=time_limit,
+                           initializer=initializer, start_seats=start_seats, optimizer_options=optimizer_options)
+        results.append((energy, sim.get_seats()))
+
+    return _get_batch_result(sim, results)
+
+
+def run_incremental(sim, seats, pinned, optimizer='particle', max_iterations=50, trials=20, patience=0,
+                    time_budget=0.5, optimizer_options=None):
+    """
+    Re-seat the unpinned passengers of a trip around the pinned ones
+    Only a few passengers move, so the trials run in this process instead of the worker pool
+    :param sim: the trip's Simulation
+    :param seats: the seat index of every passenger (-1 for passengers to seat)
+    :param pinned: a boolean array, True for passengers that keep their seats
+    :param optimizer: the name of the optimizer engine (see particle_simulation.OPTIMIZERS)
+    :param max_iterations: the iteration limit of a single trial
+    :param trials: the most trials to run
+    :param patience: stop after this many trials without improvement (0 for no limit)
+    :param time_budget: seconds to spend, 0 for no limit
+    :param optimizer_options: [Optional] extra keyword arguments of the optimizer (see run_trial)
+    :return: the best (energy, seats) tuple and the TrialScheduler
+    """
+    scheduler = TrialScheduler(trials, patience=patience, time_budget=time_budget)
+    deadline = time.monotonic() + time_budget if time_budget > 0 else None
+
+    sim.pin_particles(pinned)
+    best = None
+
+    while True:
+        sim.init_particles(seats=np.where(pinned, seats, -1))
+        energy, _ = ps.OPTIMIZERS[optimizer](sim, show_result=False, max_iterations=max_iterations, debug=False,
+                                             deadline=deadline, **(optimizer_options or dict()))
+        scheduler.add_result(energy)
+
+        if best is None or energy < best[0]:
+            best = (energy, sim.get_seats())
+
+        if scheduler.should_stop():
+            break
+
+    return best, scheduler
+
+
+class TrialRunner:
+    """
+    Runs simulation trials on a pool of worker processes
+    Workers only receive the compact passenger state and return seat index arrays
+    """
+
+    def __init__(self, layout_file, image_file, passengers, repulsive_force, attractive_force, orphan_penalty,
+                 optimizer='particle', max_iterations=50, workers=0, exact_max_seats=0, exact_max_nodes=20000,
+                 trial_time_limit=0, initializer='random', collect_stats=False, seed=None, optimizer_options=None):
+        self._layout_file = layout_file
+        self._image_file = image_file
+        self._state = ps.PassengerState.from_particles(passengers)
+        self._forces = (repulsive_force, attractive_force, orphan_penalty)
+        self._optimizer = optimizer
+        self._optimizer_options = optimizer_options
+        self._max_iterations = max_iterations
+        self._trial_time_limit = trial_time_limit
+        self._initializer = initializer
+        self._collect_stats = collect_stats
+
+        # Trial i of the run always gets the seed get_trial_seed(seed, i) (see run_trial)
+        self.seed = get_master_seed(seed)
+
+        # Merged instrumentation of every trial (None unless collect_stats)
+        self.stats = ps.SimulationStats() if collect_stats else None
+        self._workers = get_worker_count(workers)
+
+        # Background trials (see start and poll)
+        self._executor = None
+        self._pending = set()
+
+        # On boats of up to exact_max_seats seats (0 turns this off) a branch and bound search runs next to the
+        # trials, and the run can stop as soon as it proves a seating optimal (see collect)
+        seat_count = len(layout.get_layout(layout_file).seats)
+        self._exact = seat_count <= exact_max_seats
+        self._exact_max_nodes = exact_max_nodes
+        self._exact_futures = set()
+        self.optimal = False
+
+    def _get_batch_sizes(self, trials):
+        # Several small batches per worker keep the progress bar moving
+        batch_size = max(1, trials // (self._workers * 8))
+
+        sizes = [batch_size] * (trials // batch_size)
+        if trials % batch_size:
+            sizes.append(trials % batch_size)
+        return sizes
+
+    def submit(self, executor, trials, start_seats=None):
+        """
+        Queue the trials on an existing executor (e.g. one shared by several trips)
+        :param executor: a ProcessPoolExecutor
+        :param trials: the number of trials to run
+        :param start_seats: [Optional] seat indices of one extra trial, queued first, that polishes an earlier
+                            layout (e.g. the cached chart of an older manifest), -1 for passengers to place randomly
+        :return: a list of futures, each resolving to a list of (energy, seats) tuples and the batch's
+                 stats data (see run_trials)
+        """
+        futures = list()
+        if start_seats is not None:
+            futures.append(executor.submit(run_trials, self._layout_file, self._image_file, self._state,
+                                           self._forces, self._optimizer, self._max_iterations, 1,
+                                           time_limit=self._trial_time_limit, collect_stats=self._collect_stats,
+                                           seed=self.seed, first_trial=trials, start_seats=start_seats,
+                                           optimizer_options=self._optimizer_options))
+
+        if self._exact:
+            future = executor.submit(run_exact_trial, self._layout_file, self._image_file, self._state,
+                                     self._forces, self._max_iterations, self._exact_max_nodes,
+                                     collect_stats=self._collect_stats, seed=self.seed, trial=trials + 1)
+            self._exact_futures.add(future)
+            futures.append(future)
+
+        first_trial = 0
+        for size in self._get_batch_sizes(trials):
+            futures.append(executor.submit(run_trials, self._layout_file, self._image_file, self._state,
+                                           self._forces, self._optimizer, self._max_iterations, size,
+                                           time_limit=self._trial_time_limit, initializer=self._initializer,
+                                           collect_stats=self._collect_stats, seed=self.seed,
+                                           first_trial=first_trial, optimizer_options=self._optimizer_options))
+            first_trial += size
+        return futures
+
+    def collect(self, future):
+        """
+        Get the results of a finished future from submit, merging its stats
+        Sets optimal if the future held the branch and bound search and it proved its seating optimal
+        :param future: a finished future
+        :return: a list of (energy, seats) tuples
+        """
+        results, stats = future.result()
+        if stats is not None:
+            self.stats.merge(stats)
+
+        if future in self._exact_futures and len(results) > 0:
+            self.optimal = True
+        return results
+
+    def start(self, trials, start_seats=None):
+        """
+        Start the trials in the background and return at once
+        Finished trials are collected with poll (e.g. from a GUI timer), so the caller never blocks
+        :param trials: the number of trials to run
+        :param start_seats: [Optional] an earlier layout to polish in an extra trial (see submit)
+        :return: None
+        """
+        self._executor = ProcessPoolExecutor(max_workers=self._workers)
+        self._pending = set(self.submit(self._executor, trials, start_seats=start_seats))
+
+    def poll(self):
+        """
+        Collect the trials that finished since the last call without waiting for the others
+        :return: a list of (energy, seats) tuples
+        """
+        done = [future for future in self._pending if future.done()]
+        self._pending.difference_update(done)
+
+        results = list()
+        for future in done:
+            results.extend(self.collect(future))
+
+        if len(self._pending) == 0:
+            self.abort()
+        return results
+
+    def is_running(self):
+        """
+        :return: True while trials started with start have not all been collected
+        """
+        return len(self._pending) > 0
+
+    def abort(self):
+        """
+        Halt the running trials
+        :return: None
+        """
+        if self._executor is not None:
+            # Queued trials are dropped, running batches finish in the background
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._pending = set()
+
+
+class TrialScheduler:
+    """
+    Decides when to stop running trials
+    Stops once the best energy has not improved for `patience` trials or after `time_budget` seconds
+    (0 disables either rule), or as soon as the best seating is proven optimal (see set_optimal)
+    """
+
+    def __init__(self, trials, patience=0, time_budget=0, tolerance=1e-9):
+        self.trials = trials
+        self.patience = patience
+        self.time_budget = time_budget
+        self.tolerance = tolerance
+
+        self.best_energy = None
+        self.best_trial = None
+        self.history = list()
+        self.optimal = False
+        self._start_time = time.monotonic()
+
+    def add_result(self, energy):
+        """
+        Record a finished trial
+        :param energy: the trial's energy
+        :return: True if the trial improved on the best energy
+        """
+        improved = self.best_energy is None or energy < self.best_energy - self.tolerance
+        if improved:
+            self.best_energy = energy
+            self.best_trial = len(self.history)
+
+        self.history.append(self.best_energy)
+        return improved
+
+    def set_optimal(self):
+        """
+        Record that the best result is proven optimal (see TrialRunner.collect)
+        :return: None
+        """
+        self.optimal = True
+
+    def get_elapsed(self):
+        return time.monotonic() - self._start_time
+
+    def is_plateau(self):
+        return self.patience > 0 and self.best_trial is not None and \
+            len(self.history) - 1 - self.best_trial >= self.patience
+
+    def is_out_of_time(self):
+        return self.time_budget > 0 and self.get_elapsed() >= self.time_budget
+
+    def should_stop(self):
+        """
+        :return: True if no more trials should run
+        """
+        return self.optimal or len(self.history) >= self.trials or self.is_plateau() or self.is_out_of_time()
+
+    def get_stats(self):
+        """
+        Get the convergence statistics of the trials
+        :return: a dictionary
+        """
+        if self.optimal:
+            reason = "proven optimal"
+        elif self.is_plateau():
+            reason = "plateau"
+        elif self.is_out_of_time():
+            reason = "time budget"
+        else:
+            reason = "trials"
+
+        return {'trials_run': len(self.history),
+                'trials_saved': max(0, self.trials - len(self.history)),
+                'best_energy': self.best_energy,
+                'best_trial': self.best_trial,
+                'elapsed': self.get_elapsed(),
+                'stop_reason': reason,
+                'best_energy_history': list(self.history)}
+
+    def get_summary(self):
+        stats = self.get_stats()
+        return "Stopped after %d/%d trials (%s, %d trials saved)" % (stats['trials_run'], self.trials,
+                                                                      stats['stop_reason'], stats['trials_saved'])